@@ -2,8 +2,9 @@ from bokeh.models import Select, Div
 from bokeh.models.widgets import RadioButtonGroup
 import census_read_data as crd
 import census_read_geopandas as crg
+import census_geometry_arrays as cga
 import pandas as pd
-from bokeh.models import GeoJSONDataSource
+from bokeh.models import ColumnDataSource
 from bokeh.models import LinearColorMapper, ColorBar, PrintfTickFormatter
 from bokeh.models import HoverTool
 from bokeh.plotting import figure, curdoc
@@ -11,14 +12,27 @@ from bokeh.layouts import row, column
 
 # Get Census Merged Ward and Local Authority Data
 geography = crd.read_geography()
+geography_lookup = crd.Geography(geography)
 locationcol = "GeographyCode"
 namecol = "Name"
 
-# Get London Ward GeoPandas DataFrame
-london_wards_gdf = crg.read_london_ward_geopandas()
+# Ward and LAD geometries at every level of simplification, level 0 is full
+# resolution. They are memory mapped, so worker processes share one copy
+levels = range(len(crg.LEVEL_TOLERANCES))
+london_wards_levels = [cga.open_geometry_arrays('ward', level=level) for level in levels]
+london_lads_levels = [cga.open_geometry_arrays('lad', level=level) for level in levels]
 
-# Get LAD GeoPandas DataFrame
-london_lads_gdf = crg.read_london_lad_geopandas()
+# Ward and LAD attributes, geometries are attached when a map is drawn
+london_wards_df = london_wards_levels[0].frame
+london_lads_df = london_lads_levels[0].frame
+
+# Bounding boxes of each ward and LAD, and of London
+london_ward_bounds = crg.read_bounds('ward')
+london_lad_bounds = crg.read_bounds('lad')
+
+# Only London data is needed
+london_ids = london_wards_df['cmwd11cd'].tolist() + \
+    london_lads_df['lad11cd'].tolist()
 
 # Get Census data index and its table_names
 index = crd.read_index()
@@ -38,11 +52,11 @@ for i in range(4):
 granularities = ['Local Authorities', 'Wards']
 granularity_widget = RadioButtonGroup(labels=granularities, active=0)
 local_authority_label = Div(text='Wards for Local Authority', width=200)
-local_authorities = geography['LAD11CD'].unique()
+local_authorities = london_lads_df['lad11cd'].tolist()
 local_authority_widget = Select(title='',
                                 options=[('All', 'All')] +
-                                [(lad, geography[geography[locationcol] == lad][namecol].iat[0])
-                                    for lad in local_authorities],
+                                list(zip(local_authorities,
+                                         geography_lookup.names_for(local_authorities))),
                                 value='All')
 
 widgets = column(row(table_label, table_name_widget),
@@ -58,15 +72,13 @@ table_name = ''         # Current table
 categories = []         # Categories for table
 tdf = None              # Table description DataFrame
 all_categories = False  # All categories specified
-query_string = ''       # Category filter string
+category_values = []    # Selected category values
 df = None               # Table data DataFrame
-london_lads_data_gdf = None     # London LAD data
-london_wards_data_gdf = None    # London Ward data
 
 
 def update_table(attr, old, new):
     # Callback gets table data, invokes categories callback
-    global table_name, categories, tdf, df, london_lads_data_gdf, london_wards_data_gdf
+    global table_name, categories, tdf, df
 
     if old is not None and new == old:
         return
@@ -75,15 +87,10 @@ def update_table(attr, old, new):
     if table_name != '':
         tdf = crd.read_table(table_name)
         categories = crd.get_table_column_names_and_values(tdf)
-        df = crd.read_data(table_name)
+        df = crd.read_data(table_name, geographies=london_ids, compact=True)
         # Add names to data
-        df = pd.merge(df, geography, on=locationcol)
-
-        # Merge the data table (all data items) with the geo data
-        london_lads_data_gdf = london_lads_gdf.merge(
-            df, left_on='lad11cd', right_on=locationcol)
-        london_wards_data_gdf = london_wards_gdf.merge(
-            df, left_on='cmwd11cd', right_on=locationcol)
+        df = crd.compact_frame(pd.merge(df, geography, on=locationcol))
+        crd.track_frame('London ' + table_name, df)
 
     else:
         categories = []
@@ -92,11 +99,11 @@ def update_table(attr, old, new):
 
 def update_categories(attr, old, new):
     # Callback updates categories and collects category values, invokes graph callback
-    global all_categories, query_string
+    global all_categories, category_values
 
     # Update category widgets
     all_categories = len(categories) > 0
-    query_categories = []
+    selected_values = []
 
     def update_category(category, label_widget, category_widget):
         if category is not None:
@@ -122,14 +129,13 @@ def update_categories(attr, old, new):
     for i, category in enumerate(categories):
         all_categories &= update_category(category,
                                           category_labels[i], category_widgets[i])
-        query_categories.append(
-            f'`{category_labels[i].text}` == "{category_widgets[i].value}"')
+        selected_values.append(category_widgets[i].value)
     # Clear remaining category widgets
     for i in range(len(categories), len(category_widgets)):
         all_categories &= update_category(None,
                                           category_labels[i], category_widgets[i])
 
-    query_string = " & ".join(query_categories)
+    category_values = selected_values
     update_graph(attr, old, new)
 
 
@@ -140,33 +146,45 @@ def update_graph(attr, old, new):
         # Just show widgets
         layout = widgets
     else:
-        trow = tdf.query(query_string)
-        datacol = table_name + trow.iloc[0, -1]
-        lad_max_value = london_lads_data_gdf[datacol].max()
-        ward_max_value = london_wards_data_gdf[datacol].max()
+        datacol = table_name + \
+            crd.resolve_dataset(table_name, category_values)
+        # Take the columns the map uses for each ward and LAD through the
+        # layers' join indexes, rather than merging the table onto them
+        columns = [locationcol, namecol, datacol, 'LAD11NM']
+        london_lads_data_df = london_lads_levels[0].join_frame(df, columns)
+        london_wards_data_df = london_wards_levels[0].join_frame(df, columns)
+        lad_max_value = london_lads_data_df[datacol].max()
+        ward_max_value = london_wards_data_df[datacol].max()
         title = datacol + " by Local Authority"
 
         granularity = granularities[granularity_widget.active]
         local_authority = local_authority_widget.value
 
         if granularity == 'Local Authorities':
-            gdf = london_lads_data_gdf
+            fdf = london_lads_data_df
+            key, geometry_levels = 'lad11cd', london_lads_levels
+            bbox = london_lad_bounds.bbox
             max_value = lad_max_value
             title = datacol + " by Local Authority"
         else:
+            key, geometry_levels = 'cmwd11cd', london_wards_levels
             max_value = ward_max_value
             if local_authority == 'All':
-                gdf = london_wards_data_gdf
+                fdf = london_wards_data_df
+                bbox = london_ward_bounds.bbox
                 title = datacol + " by Ward"
             else:
-                gdf = london_wards_data_gdf[london_wards_data_gdf['lad11cd'].str.match(
+                fdf = london_wards_data_df[london_wards_data_df['lad11cd'].str.match(
                     local_authority)]
-                local_authority_name = geography[geography['GeographyCode'] ==
-                                                 local_authority].iloc[0]['Name']
+                bbox = london_ward_bounds.lad_bbox(local_authority)
+                local_authority_name = geography_lookup.name_for(local_authority)
                 title = datacol + " by Ward for " + local_authority_name
 
-        # Input GeoJSON source that contains features for plotting
-        geosource = GeoJSONDataSource(geojson=gdf.to_json())
+        # Draw the simplest level that is still accurate to a pixel
+        level = crg.level_for_extent(bbox, pixels=1200)
+        # Patch coordinates for plotting, with only the columns the map uses
+        geosource = ColumnDataSource(
+            data=geometry_levels[level].column_data(fdf, key, columns))
 
         # Create color bar
         color_mapper = LinearColorMapper(
@@ -11,6 +11,7 @@ from bokeh.layouts import column
 
 # Get Census Merged Ward and Local Authority Data
 geography = crd.read_geography()
+geography_lookup = crd.Geography(geography)
 locationcol = "GeographyCode"
 namecol = "Name"
 
@@ -48,7 +49,7 @@ lad_max_value = london_lads_data_gdf[datacol].max()
 ward_max_value = london_wards_data_gdf[datacol].max()
 title = datacol + " by Local Authority"
 
-local_authorities = geography['LAD11CD'].unique()
+local_authorities = geography_lookup.lad_codes
 granularities = ['Local Authorities', 'Wards']
 
 # Create Widgets
@@ -56,8 +57,8 @@ granularity_widget = RadioButtonGroup(labels=granularities,
                                       active=0)
 local_authority_widget = Select(title='Wards for Local Authority',
                                 options=[('All', 'All')] +
-                                [(lad, geography[geography[locationcol] == lad][namecol].iat[0])
-                                 for lad in local_authorities],
+                                list(zip(local_authorities,
+                                         geography_lookup.names_for(local_authorities))),
                                 value='All')
 
 
@@ -78,8 +79,7 @@ def update_graph(attr, old, new):
         else:
             gdf = london_wards_data_gdf[london_wards_data_gdf['lad11cd'].str.match(
                 local_authority)]
-            local_authority_name = geography[geography['GeographyCode'] ==
-                                             local_authority].iloc[0]['Name']
+            local_authority_name = geography_lookup.name_for(local_authority)
             title = datacol + " by Ward for " + local_authority_name
 
     # Input GeoJSON source that contains features for plotting
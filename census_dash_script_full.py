@@ -1,31 +1,37 @@
 from dash.exceptions import PreventUpdate
 import census_read_data as crd
 import census_read_geojson as crg
-import pandas as pd
-import plotly.express as px
+import census_geometry_arrays as cga
+import census_tiles as ctl
+import census_figure_cache as cfc
+import threading
+from collections import OrderedDict
 import plotly.graph_objects as go
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 from dash import html
 from dash import dcc
 import dash
 import dash_bootstrap_components as dbc
-from turfpy.measurement import bbox
-from functools import reduce
 
 # Get Census Merged Ward and Local Authority Data
 geography = crd.read_geography()
+geography_lookup = crd.Geography(geography)
 locationcol = "GeographyCode"
 namecol = "Name"
 
-# Get London GeoJSON
-london_wards = crg.read_london_ward_geojson()
-london_ward_ids = list(map(lambda f: f['properties']
-                           ['cmwd11cd'], london_wards["features"]))
+# Ward and LAD geometries at every level of simplification, level 0 is full
+# resolution. They are memory mapped, so worker processes share one copy, and
+# GeoJSON is only built for the features being drawn
+levels = range(len(crg.LEVEL_TOLERANCES))
+london_wards_levels = [cga.open_geometry_arrays('ward', level=level) for level in levels]
+london_lads_levels = [cga.open_geometry_arrays('lad', level=level) for level in levels]
+london_ward_ids = london_wards_levels[0].codes.tolist()
+london_lad_ids = london_lads_levels[0].codes.tolist()
+london_wards_df = london_wards_levels[0].frame
 
-# Get LAD GeoJSON
-london_lads = crg.read_london_lad_geojson()
-london_lad_ids = list(map(lambda f: f['properties']
-                          ['lad11cd'], london_lads["features"]))
+# Bounding boxes of each ward and LAD, and of London
+london_ward_bounds = crg.read_bounds('ward')
+london_lad_bounds = crg.read_bounds('lad')
 
 
 index = crd.read_index()
@@ -44,21 +50,54 @@ def blank_fig():
     return fig
 
 
-def compute_bbox(gj):
-    # Compute bounding box for GeoJSON
-    gj_bbox_list = list(
-        map(lambda f: bbox(f['geometry']), gj['features']))
-    gj_bbox = reduce(
-        lambda b1, b2: [min(b1[0], b2[0]), min(b1[1], b2[1]),
-                        max(b1[2], b2[2]), max(b1[3], b2[3])],
-        gj_bbox_list)
-    return gj_bbox
-
-
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# Vector tiles, data values to join to them and a MapLibre page drawing
+# both at /tiles/map, tiles built by census_ingest.py build-tiles
+ctl.add_tile_routes(app.server)
+ctl.add_value_routes(app.server)
+
+# Built map figures, the most recently used in memory, and with
+# DISK_FIGURE_CACHE also on disk for restarted workers
+DISK_FIGURE_CACHE = False
+figure_cache = cfc.FigureCache(
+    cache_dir=cfc.FIGURE_CACHE_DIR if DISK_FIGURE_CACHE else None)
+
+# London values of recently drawn data columns, so changing granularity or
+# Local Authority does not read the table again
+COLUMN_CACHE_SIZE = 64
+london_columns = OrderedDict()  # (table, column, size, mtime) to values, oldest first
+london_columns_lock = threading.Lock()
+
+
+def read_london_column(table_name, datacol):
+    # Values of one data column for every London ward and LAD, by GeographyCode
+    datafile = crd.source_key(crd.data_file(table_name))
+    key = (table_name, datacol, datafile['size'], datafile['mtime'])
+    with london_columns_lock:
+        if key in london_columns:
+            london_columns.move_to_end(key)
+            return london_columns[key]
+    # Read only the data column for London
+    df = crd.read_data(table_name, columns=[datacol],
+                       geographies=london_ward_ids + london_lad_ids,
+                       compact=True)
+    column = df.set_index(locationcol)[datacol]
+    with london_columns_lock:
+        london_columns[key] = column
+        if len(london_columns) > COLUMN_CACHE_SIZE:
+            london_columns.popitem(last=False)
+    return column
+
+
+@app.server.route('/figure-cache')
+def figure_cache_stats():
+    # Hit and miss counts for this worker
+    return figure_cache.stats()
 
 local_authorities = london_lad_ids
 all_local_authorities = ['All'] + local_authorities
+all_local_authority_names = ['All'] + \
+    geography_lookup.names_for(local_authorities).tolist()
 
 table_controls = dbc.Card(
     [
@@ -148,11 +187,9 @@ map_controls = dbc.Card(
                     dbc.Select(
                         id='local-authority',
                         options=[
-                            #{'label': i, 'value': i}
-                            {'label': 'All' if i == 'All'
-                                else geography[geography[locationcol] == i][namecol].iat[0],
-                                'value': i}
-                            for i in all_local_authorities],
+                            {'label': name, 'value': i}
+                            for i, name in zip(all_local_authorities,
+                                               all_local_authority_names)],
                         value='All'
                     )
                 ],
@@ -174,6 +211,14 @@ app.layout = dbc.Container(
                 dbc.Row(map_controls),
                 dbc.Row(dcc.Graph(id='map', figure=blank_fig()),
                         class_name='mt-3'),
+                # Boundaries are sent when the features drawn change, and
+                # data values for each dataset, see draw_map
+                dcc.Store(id='map-geometry'),
+                dcc.Store(id='map-geometry-key'),
+                dcc.Store(id='map-values'),
+                # Stages of the data callbacks: table, categories, column
+                dcc.Store(id='table-categories'),
+                dcc.Store(id='dataset-column'),
             ],
             align="center",
         ),
@@ -182,8 +227,133 @@ app.layout = dbc.Container(
 )
 
 
+def map_features(granularity, local_authority):
+    # Geometry levels, feature codes and bounding box for London LADs, or the
+    # wards of London or of one LAD
+    if granularity == 'Local Authorities':
+        return london_lads_levels, london_lad_ids, london_lad_bounds.bbox
+    if local_authority == 'All':
+        return london_wards_levels, london_ward_ids, london_ward_bounds.bbox
+    lad_ward_ids = london_wards_df['cmwd11cd'][
+        london_wards_df['lad11cd'] == local_authority].tolist()
+    return london_wards_levels, lad_ward_ids, london_ward_bounds.lad_bbox(local_authority)
+
+
+def build_map_geometry(granularity, local_authority):
+    # Boundaries and hover names of the features drawn, kept in the browser
+    geometry_levels, codes, gj_bbox = map_features(granularity, local_authority)
+    # Draw the simplest level of GeoJSON that is still accurate to a pixel
+    arrays = geometry_levels[crg.level_for_extent(gj_bbox, pixels=1200)]
+    names = geography_lookup.frame.loc[codes, [namecol, 'LAD11NM']].astype(str)
+    return {
+        'key': [granularity, local_authority],
+        'geojson': arrays.to_geojson(codes, [arrays.key], crg.GEOJSON_PRECISION),
+        'featureidkey': 'properties.' + arrays.key,
+        'locations': codes,
+        'names': names.to_numpy().tolist(),
+        'bbox': list(gj_bbox),
+    }
+
+
+def build_map_values(table_name, datacol, granularity, local_authority):
+    # Data values of the features drawn, in the order of their boundaries
+    _, codes, _ = map_features(granularity, local_authority)
+    all_codes = london_lad_ids if granularity == 'Local Authorities' else london_ward_ids
+    column = read_london_column(table_name, datacol)
+    if granularity == 'Local Authorities':
+        title = datacol + " by Local Authority"
+    elif local_authority == 'All':
+        title = datacol + " by Ward"
+    else:
+        title = datacol + " by Ward for Local Authority"
+    values = column.reindex(codes)
+    return {
+        'key': [granularity, local_authority],
+        'datacol': datacol,
+        'title': title,
+        # Colour scale is shared by every LAD's wards
+        'max_value': column.reindex(all_codes).max(),
+        'z': values.astype(object).where(values.notna(), None).tolist(),
+    }
+
+
 @app.callback(
+    Output('map-geometry', 'data'),
+    Output('map-geometry-key', 'data'),
+    Input('local-authority', 'value'),
+    Input('granularity', 'value'),
+    State('map-geometry-key', 'data'),
+)
+def update_geometry(local_authority, granularity, geometry_key):
+
+    # Every Local Authority selection shows the same LAD map
+    if granularity == 'Local Authorities':
+        local_authority = 'All'
+    # Send boundaries only when the features drawn change
+    if [granularity, local_authority] == geometry_key:
+        raise PreventUpdate
+    key = ('geometry', granularity, local_authority, london_wards_levels[0].arraydir)
+    geometry = figure_cache.get(key, lambda: build_map_geometry(
+        granularity, local_authority))
+    return geometry, geometry['key']
+
+
+# Draw the choropleth in the browser from the stored boundaries and values,
+# so a dataset change only sends the values. uirevision keeps the user's
+# zoom while the boundaries are unchanged
+app.clientside_callback(
+    """
+    function draw_map(values, geometry) {
+        if (!values || !geometry) {
+            return {data: [], layout: {xaxis: {visible: false},
+                                       yaxis: {visible: false}}};
+        }
+        if (values.key.join() !== geometry.key.join()) {
+            // The other store is still on its way
+            return window.dash_clientside.no_update;
+        }
+        var bbox = geometry.bbox;
+        return {
+            data: [{
+                type: 'choropleth',
+                geojson: geometry.geojson,
+                featureidkey: geometry.featureidkey,
+                locations: geometry.locations,
+                customdata: geometry.names,
+                z: values.z,
+                zmin: 0,
+                zmax: values.max_value,
+                colorscale: 'Viridis',
+                colorbar: {title: {text: values.datacol}},
+                hovertemplate: 'GeographyCode=%{location}<br>' + values.datacol +
+                    '=%{z}<br>Name=%{customdata[0]}<br>LAD11NM=%{customdata[1]}' +
+                    '<extra></extra>'
+            }],
+            layout: {
+                title: {text: values.title, x: 0.5},
+                geo: {
+                    scope: 'europe',
+                    center: {lon: (bbox[0] + bbox[2]) / 2.0,
+                             lat: (bbox[1] + bbox[3]) / 2.0},
+                    lonaxis: {range: [bbox[0], bbox[2]]},
+                    lataxis: {range: [bbox[1], bbox[3]]},
+                    visible: false
+                },
+                uirevision: geometry.key.join(),
+                margin: {l: 0, r: 0, b: 0, t: 30},
+                width: 1200,
+                height: 600
+            }
+        };
+    }
+    """,
     Output('map', 'figure'),
+    Input('map-values', 'data'),
+    Input('map-geometry', 'data'),
+)
+
+
+@app.callback(
     Output('category-1-label', 'children'),
     Output('category-1-values', 'options'),
     Output('category-1-container', 'style'),
@@ -196,17 +366,14 @@ app.layout = dbc.Container(
     Output('category-4-label', 'children'),
     Output('category-4-values', 'options'),
     Output('category-4-container', 'style'),
+    Output('category-1-values', 'value'),
+    Output('category-2-values', 'value'),
+    Output('category-3-values', 'value'),
+    Output('category-4-values', 'value'),
+    Output('table-categories', 'data'),
     Input('table-name', 'value'),
-    Input('category-1-values', 'value'),
-    Input('category-2-values', 'value'),
-    Input('category-3-values', 'value'),
-    Input('category-4-values', 'value'),
-    Input('local-authority', 'value'),
-    Input('granularity', 'value'),
 )
-def update_graph(table_name,
-                 category1, category2, category3, category4,
-                 local_authority, granularity):
+def update_categories(table_name):
 
     if table_name is None:
         raise PreventUpdate
@@ -215,7 +382,6 @@ def update_graph(table_name,
     categories = crd.get_table_column_names_and_values(tdf)
 
     # Update categories
-    all_categories = True
     category1label = ''
     category1values = []
     category1style = {'display': 'none'}
@@ -224,10 +390,6 @@ def update_graph(table_name,
         category1values = [{'label': cat, 'value': cat}
                            for cat in categories[0][1]]
         category1style = {'display': 'flex'}
-        if category1 is None:
-            all_categories = False
-        else:
-            query_string = f'`{category1label}` == "{category1}"'
     category2label = ''
     category2values = []
     category2style = {'display': 'none'}
@@ -236,10 +398,6 @@ def update_graph(table_name,
         category2values = [{'label': cat, 'value': cat}
                            for cat in categories[1][1]]
         category2style = {'display': 'flex'}
-        if category2 is None:
-            all_categories = False
-        else:
-            query_string += f' & `{category2label}` == "{category2}"'
     category3label = ''
     category3values = []
     category3style = {'display': 'none'}
@@ -248,10 +406,6 @@ def update_graph(table_name,
         category3values = [{'label': cat, 'value': cat}
                            for cat in categories[2][1]]
         category3style = {'display': 'flex'}
-        if category3 is None:
-            all_categories = False
-        else:
-            query_string += f' & `{category3label}` == "{category3}"'
     category4label = ''
     category4values = []
     category4style = {'display': 'none'}
@@ -260,82 +414,70 @@ def update_graph(table_name,
         category4values = [{'label': cat, 'value': cat}
                            for cat in categories[3][1]]
         category4style = {'display': 'flex'}
-        if category4 is None:
-            all_categories = False
-        else:
-            query_string += f' & `{category4label}` == "{category4}"'
 
-    # If all categories are specified then get data
-    print(f"all_categories={all_categories}")
-    if not all_categories:
-        fig = blank_fig()
-        return fig, category1label, category1values, category1style, category2label, category2values, category2style, category3label, category3values, category3style, category4label, category4values, category4style
+    # Values chosen for the previous table are cleared
+    table_categories = {'table': table_name, 'count': len(categories)}
+    return category1label, category1values, category1style, category2label, category2values, category2style, category3label, category3values, category3style, category4label, category4values, category4style, None, None, None, None, table_categories
 
-    df = crd.read_data(table_name)
-    # Add names to data
-    df = pd.merge(df, geography, on=locationcol)
 
-    # Filter London Data
-    london_flags = df[locationcol].isin(london_ward_ids)
-    london_ward_df = df[london_flags]
+@app.callback(
+    Output('dataset-column', 'data'),
+    Input('table-categories', 'data'),
+    Input('category-1-values', 'value'),
+    Input('category-2-values', 'value'),
+    Input('category-3-values', 'value'),
+    Input('category-4-values', 'value'),
+    State('dataset-column', 'data'),
+)
+def update_dataset(table_categories,
+                   category1, category2, category3, category4,
+                   dataset):
 
-    london_flags = df[locationcol].isin(london_lad_ids)
-    london_lad_df = df[london_flags]
+    if table_categories is None:
+        raise PreventUpdate
 
-    trow = tdf.query(query_string)
-    datacol = table_name + trow.iloc[0, -1]
-    ward_max_value = london_ward_df[datacol].max()
-    lad_max_value = london_lad_df[datacol].max()
+    table_name = table_categories['table']
+    category_values = [category1, category2, category3,
+                       category4][:table_categories['count']]
 
-    if granularity == 'Local Authorities':
-        fdf = london_lad_df
-        gj = london_lads
-        key = "properties.lad11cd"
-        max_value = lad_max_value
-        title = datacol + " by Local Authority"
+    # If all categories are specified then get data
+    all_categories = None not in category_values
+    print(f"all_categories={all_categories}")
+    # Values from the previous table, until they are cleared, have no dataset
+    dataset_index = crd.dataset_index(table_name)
+    if all_categories and tuple(category_values) in dataset_index:
+        datacol = table_name + dataset_index[tuple(category_values)]
+        new_dataset = {'table': table_name, 'column': datacol}
     else:
-        key = "properties.cmwd11cd"
-        max_value = ward_max_value
-        if local_authority == 'All':
-            fdf = london_ward_df
-            gj = london_wards
-            title = datacol + " by Ward"
-        else:
-            fdf = london_ward_df[london_ward_df['LAD11CD'].str.match(
-                local_authority)]
-            gj = {
-                'features': list(filter(lambda f: f['properties']['lad11cd'] == local_authority,
-                                        london_wards["features"])),
-                'type': london_wards['type'],
-                'crs': london_wards['crs']
-            }
-            title = datacol + " by Ward for Local Authority"
-
-    gj_bbox = compute_bbox(gj)
-
-    fig = px.choropleth(fdf,
-                        geojson=gj,
-                        locations=locationcol,
-                        color=datacol,
-                        color_continuous_scale="Viridis",
-                        range_color=(0, max_value),
-                        featureidkey=key,
-                        scope='europe',
-                        hover_data=[namecol, 'LAD11NM'],
-                        title=title
-                        )
-    fig.update_geos(
-        center_lon=(gj_bbox[0]+gj_bbox[2])/2.0,
-        center_lat=(gj_bbox[1]+gj_bbox[3])/2.0,
-        lonaxis_range=[gj_bbox[0], gj_bbox[2]],
-        lataxis_range=[gj_bbox[1], gj_bbox[3]],
-        visible=False,
-    )
-    fig.update_layout(margin=dict(l=0, r=0, b=0, t=30),
-                      title_x=0.5,
-                      width=1200, height=600)
-    return fig, category1label, category1values, category1style, category2label, category2values, category2style, category3label, category3values, category3style, category4label, category4values, category4style
+        new_dataset = None
+    # Only a different column redraws the map
+    if new_dataset == dataset:
+        raise PreventUpdate
+    return new_dataset
+
+
+@app.callback(
+    Output('map-values', 'data'),
+    Input('dataset-column', 'data'),
+    Input('local-authority', 'value'),
+    Input('granularity', 'value'),
+)
+def update_values(dataset, local_authority, granularity):
+
+    if dataset is None:
+        return None
+    table_name = dataset['table']
+    datacol = dataset['column']
 
+    # Every Local Authority selection shows the same LAD map
+    if granularity == 'Local Authorities':
+        local_authority = 'All'
+    # Values change with the table data and the boundaries
+    datafile = crd.source_key(crd.data_file(table_name))
+    key = (table_name, datacol, granularity, local_authority,
+           datafile['size'], datafile['mtime'], london_wards_levels[0].arraydir)
+    return figure_cache.get(key, lambda: build_map_values(
+        table_name, datacol, granularity, local_authority))
 
 if __name__ == '__main__':
     app.run_server(debug=True)
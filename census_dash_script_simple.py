@@ -8,19 +8,23 @@ from dash import html
 from dash import dcc
 import dash
 import dash_bootstrap_components as dbc
-from turfpy.measurement import bbox
-from functools import reduce
 
 # Get Census Merged Ward and Local Authority Data
 geography = crd.read_geography()
+geography_lookup = crd.Geography(geography)
 locationcol = "GeographyCode"
 namecol = "Name"
 
-# Get London GeoJSON
-london_wards = crg.read_london_ward_geojson()
+# Get London GeoJSON, quantized for the browser
+london_wards = crg.quantize_geojson(crg.read_london_ward_geojson(),
+                                    keep=['cmwd11cd', 'lad11cd'])
 
-# Get LAD GeoJSON
-london_lads = crg.read_london_lad_geojson()
+# Bounding boxes of each ward and LAD, and of London
+london_ward_bounds = crg.read_london_bounds('ward')
+london_lad_bounds = crg.read_london_bounds('lad')
+
+# Get LAD GeoJSON, quantized for the browser
+london_lads = crg.quantize_geojson(crg.read_london_lad_geojson(), keep=['lad11cd'])
 
 # Get Census data index and its table_names
 index = crd.read_index()
@@ -63,21 +67,12 @@ def blank_fig():
     return fig
 
 
-def compute_bbox(gj):
-    # Compute bounding box for GeoJSON
-    gj_bbox_list = list(
-        map(lambda f: bbox(f['geometry']), gj['features']))
-    gj_bbox = reduce(
-        lambda b1, b2: [min(b1[0], b2[0]), min(b1[1], b2[1]),
-                        max(b1[2], b2[2]), max(b1[3], b2[3])],
-        gj_bbox_list)
-    return gj_bbox
-
-
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
 local_authorities = london_lad_ids
 all_local_authorities = ['All'] + local_authorities
+all_local_authority_names = ['All'] + \
+    geography_lookup.names_for(local_authorities).tolist()
 
 map_controls = dbc.Card(
     [
@@ -105,11 +100,9 @@ map_controls = dbc.Card(
                     dbc.Select(
                         id='local-authority',
                         options=[
-                            #{'label': i, 'value': i}
-                            {'label': 'All' if i == 'All'
-                                else geography[geography[locationcol] == i][namecol].iat[0],
-                                'value': i}
-                            for i in all_local_authorities],
+                            {'label': name, 'value': i}
+                            for i, name in zip(all_local_authorities,
+                                               all_local_authority_names)],
                         value='All'
                     )
                 ],
@@ -147,6 +140,7 @@ def update_graph(local_authority, granularity):
     if granularity == 'Local Authorities':
         fdf = london_lad_df
         gj = london_lads
+        gj_bbox = london_lad_bounds.bbox
         key = "properties.lad11cd"
         max_value = lad_max_value
         title = datacol + " by Local Authority"
@@ -156,19 +150,18 @@ def update_graph(local_authority, granularity):
         if local_authority == 'All':
             fdf = ldf
             gj = london_wards
+            gj_bbox = london_ward_bounds.bbox
             title = datacol + " by Ward"
         else:
             fdf = ldf[ldf['LAD11CD'].str.match(local_authority)]
             gj = {
                 'features': list(filter(lambda f: f['properties']['lad11cd'] == local_authority,
                                         london_wards["features"])),
-                'type': london_wards['type'],
-                'crs': london_wards['crs']
+                'type': london_wards['type']
             }
+            gj_bbox = london_ward_bounds.lad_bbox(local_authority)
             title = datacol + " by Ward for Local Authority"
 
-    gj_bbox = compute_bbox(gj)
-
     fig = px.choropleth(fdf,
                         geojson=gj,
                         locations=locationcol,
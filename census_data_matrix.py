@@ -0,0 +1,129 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import census_read_data as crd
+
+MATRIX_DIR = 'data/cache/matrix'
+MATRIX_FILE = MATRIX_DIR + '/matrix.npy'
+MATRIX_INDEX_FILE = MATRIX_DIR + '/index.json'
+
+
+def build_matrix(table_names):
+    # Write every table's data into one geography by variable matrix.
+    # Columns are contiguous (Fortran order), so each variable is one block on disk
+
+    # First pass reads only the geography codes and column types
+    table_codes = {}
+    table_columns = {}
+    integral = True
+    for table_name in table_names:
+        table_codes[table_name] = crd.read_data(
+            table_name, columns=[])[crd.LOCATION_COL]
+        schema = pa.ipc.open_file(crd.data_cache_file(table_name)).schema
+        fields = [field for field in schema if field.name != crd.LOCATION_COL]
+        table_columns[table_name] = [field.name for field in fields]
+        integral &= all(pa.types.is_integer(field.type) for field in fields)
+    geographies = pd.Index(pd.unique(pd.concat(table_codes.values())))
+    variables = [col for table_name in table_names
+                 for col in table_columns[table_name]]
+    # Missing values need NaN, so tables without every geography need floats
+    complete = all(len(codes) == len(geographies)
+                   for codes in table_codes.values())
+    dtype = np.int32 if integral and complete else np.float32
+
+    os.makedirs(MATRIX_DIR, exist_ok=True)
+    tmpfile = MATRIX_DIR + '/matrix.tmp.npy'
+    matrix = np.lib.format.open_memmap(tmpfile, mode='w+', dtype=dtype,
+                                       shape=(len(geographies), len(variables)),
+                                       fortran_order=True)
+    if dtype == np.float32:
+        matrix[:] = np.nan
+
+    # Second pass copies each table into its block of columns
+    col = 0
+    for table_name in table_names:
+        df = crd.read_data(table_name)
+        columns = table_columns[table_name]
+        values = df[columns].to_numpy()
+        if dtype == np.int32 and len(values) > 0 and \
+                (values.min() < np.iinfo(np.int32).min or values.max() > np.iinfo(np.int32).max):
+            raise ValueError(f'{table_name} has values outside int32')
+        rows = geographies.get_indexer(df[crd.LOCATION_COL])
+        matrix[rows, col:col+len(columns)] = values
+        col += len(columns)
+    matrix.flush()
+    del matrix
+
+    manifest = crd.read_manifest()
+    index = {
+        'geographies': geographies.tolist(),
+        'variables': variables,
+        'dtype': np.dtype(dtype).name,
+        'sources': {table_name: manifest.get(table_name) for table_name in table_names}
+    }
+    os.replace(tmpfile, MATRIX_FILE)
+    with open(MATRIX_INDEX_FILE, 'w') as mf:
+        json.dump(index, mf)
+    return index
+
+
+class DataMatrix:
+    # Memory mapped matrix of every census variable, rows indexed by
+    # GeographyCode and columns by dataset column name (table name + Dataset).
+    # Processes that open the same file share its pages in the page cache
+
+    def __init__(self):
+        with open(MATRIX_INDEX_FILE) as mf:
+            index = json.load(mf)
+        self.matrix = np.load(MATRIX_FILE, mmap_mode='r')
+        self.geographies = pd.Index(index['geographies'])
+        self.variables = pd.Index(index['variables'])
+        self.sources = index['sources']
+
+    def is_current(self):
+        # True if no table has changed since the matrix was built
+        return all(crd.is_source_current(key, crd.data_file(table_name))
+                   for table_name, key in self.sources.items())
+
+    def positions(self, index, keys):
+        positions = index.get_indexer(keys)
+        if (positions < 0).any():
+            raise KeyError(np.asarray(keys)[positions < 0].tolist())
+        return positions
+
+    def get_variable(self, code):
+        # All geographies for one variable, a zero-copy view of the file
+        return self.matrix[:, self.variables.get_loc(code)]
+
+    def get_variables(self, codes, geographies=None):
+        # Variables for all or selected geographies. Adjacent variables for all
+        # geographies are a zero-copy view, other selections are copied
+        cols = self.positions(self.variables, codes)
+        if len(cols) > 0 and (np.diff(cols) == 1).all():
+            block = self.matrix[:, cols[0]:cols[-1]+1]
+        else:
+            block = self.matrix[:, cols]
+        if geographies is None:
+            return block
+        rows = self.positions(self.geographies, geographies)
+        return block[rows]
+
+    def get_frame(self, codes, geographies=None):
+        # Variables as a DataFrame laid out like read_data
+        values = self.get_variables(codes, geographies)
+        df = pd.DataFrame(values, columns=codes)
+        df.insert(0, crd.LOCATION_COL,
+                  self.geographies if geographies is None else geographies)
+        return df
+
+
+if __name__ == '__main__':
+    index = crd.read_index()
+    table_names = [table[0] for table in crd.get_table_names(index)]
+    build_matrix(table_names)
+    dm = DataMatrix()
+    print(dm.matrix.shape, dm.matrix.dtype)
+    datacol = dm.variables[0]
+    print(dm.get_frame([datacol]).head())
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from plotly.utils import PlotlyJSONEncoder
+
+FIGURE_CACHE_DIR = 'data/cache/figures'
+
+
+class FigureCache:
+    # Least recently used cache of built figures, or the data a clientside
+    # callback draws them from, held as JSON and bounded by their total size.
+    # With cache_dir every figure is also written to disk, so a restarted
+    # worker reads figures instead of building them again. The disk files are
+    # bounded by max_disk_bytes, removing the least recently used first
+
+    def __init__(self, max_bytes=256 << 20, cache_dir=None, max_disk_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.figures = OrderedDict()    # Key to figure JSON, oldest first
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def figure_file(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return f'{self.cache_dir}/{digest}.json'
+
+    def get(self, key, build):
+        # Figure dict for key, calling build() on a miss for a plotly figure or
+        # other data plotly can encode as JSON, e.g. dicts of lists and arrays.
+        # key must have a stable repr, e.g. a tuple of strings and numbers
+        with self.lock:
+            if key in self.figures:
+                self.figures.move_to_end(key)
+                self.hits += 1
+                return json.loads(self.figures[key])
+
+        figure_json = None
+        if self.cache_dir is not None:
+            figure_json = self.read_figure_file(key)
+            if figure_json is not None:
+                with self.lock:
+                    self.disk_hits += 1
+        if figure_json is None:
+            figure_json = json.dumps(build(), cls=PlotlyJSONEncoder)
+            with self.lock:
+                self.misses += 1
+            if self.cache_dir is not None:
+                self.write_figure_file(key, figure_json)
+
+        with self.lock:
+            if key not in self.figures:
+                self.figures[key] = figure_json
+                self.nbytes += len(figure_json)
+            # Evict least recently used figures, always keeping the newest
+            while self.nbytes > self.max_bytes and len(self.figures) > 1:
+                _, evicted = self.figures.popitem(last=False)
+                self.nbytes -= len(evicted)
+        return json.loads(figure_json)
+
+    def read_figure_file(self, key):
+        # Figure JSON from disk, None if missing or unreadable, e.g. truncated
+        filename = self.figure_file(key)
+        try:
+            with open(filename) as f:
+                figure_json = f.read()
+            json.loads(figure_json)
+            # Recently read files are kept longest
+            os.utime(filename)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            if os.path.exists(filename):
+                os.remove(filename)
+            return None
+        return figure_json
+
+    def write_figure_file(self, key, figure_json):
+        # Temporary file is named for this process and thread, as forked
+        # workers can share thread idents
+        os.makedirs(self.cache_dir, exist_ok=True)
+        filename = self.figure_file(key)
+        tmpfile = f'{filename}.tmp{os.getpid()}.{threading.get_ident()}'
+        with open(tmpfile, 'w') as f:
+            f.write(figure_json)
+        os.replace(tmpfile, filename)
+        self.prune_figure_files()
+
+    def prune_figure_files(self):
+        # Remove the least recently used files until under max_disk_bytes
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        nbytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if nbytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass    # Removed by another worker
+            nbytes -= size
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                    'misses': self.misses, 'figures': len(self.figures),
+                    'bytes': self.nbytes, 'max_bytes': self.max_bytes}
@@ -0,0 +1,205 @@
+import geopandas as gpd
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+import shapely
+import census_read_geopandas as crgp
+
+GEOMETRY_ARRAY_DIR = 'data/cache/geometry_arrays'
+LOCATION_COL = 'GeographyCode'
+
+
+def geometry_array_dir(layer, region=crgp.LONDON, level=0):
+    # Named after the layer's GeoParquet cache, so a changed shapefile gets new arrays
+    cachefile = crgp.geometry_cache_file(
+        crgp.LAYERS[layer], crgp.region_key(region), 4326, level)
+    return GEOMETRY_ARRAY_DIR + '/' + os.path.splitext(os.path.basename(cachefile))[0]
+
+
+def build_geometry_arrays(layer, region=crgp.LONDON, level=0):
+    # Write a layer's geometries as flat coordinate and offset arrays (see
+    # shapely.to_ragged_array) and its other columns as Feather
+    arraydir = geometry_array_dir(layer, region, level)
+    gdf = crgp.read_region(layer, region, level=level)
+    geometry_type, coords, offsets = shapely.to_ragged_array(gdf.geometry.values)
+
+    tmpdir = f'{arraydir}.tmp{os.getpid()}'
+    os.makedirs(tmpdir, exist_ok=True)
+    np.save(tmpdir + '/coords.npy', coords)
+    for i, offset in enumerate(offsets):
+        np.save(f'{tmpdir}/offsets{i}.npy', offset)
+    feather.write_feather(pd.DataFrame(gdf.drop(columns=gdf.geometry.name)),
+                          tmpdir + '/attributes.feather')
+    with open(tmpdir + '/index.json', 'w') as f:
+        json.dump({'geometry_type': int(geometry_type), 'offsets': len(offsets),
+                   'key': crgp.LAYER_KEYS[layer], 'crs': gdf.crs.to_string()}, f)
+    try:
+        os.replace(tmpdir, arraydir)
+    except OSError:
+        # Another process built the same arrays first
+        shutil.rmtree(tmpdir)
+    return arraydir
+
+
+def join_index(codes, data_codes):
+    # Row of data_codes for each of codes, -1 where there is no data
+    return pd.Index(np.asarray(data_codes, dtype=object)).get_indexer(
+        np.asarray(codes, dtype=object))
+
+
+def attach_columns(gdf, key, df, columns):
+    # gdf's rows that have data in df, with columns of df added through a join
+    # index instead of a merge, so geometries are not copied
+    join = join_index(gdf[key], df[LOCATION_COL])
+    present = join >= 0
+    gdf = gdf.copy(deep=False) if present.all() else gdf[present].copy(deep=False)
+    for column in columns:
+        gdf[column] = df[column].to_numpy()[join[present]]
+    return gdf
+
+
+def take_ragged(coords, offsets, rows):
+    # Coordinates and offsets (see shapely.to_ragged_array) of only the given
+    # geometry rows, working from the geometry offsets down to coordinates
+    index = np.asarray(rows, dtype=np.int64)
+    taken = []
+    for offset in reversed(offsets):
+        starts = offset[index]
+        lengths = offset[index + 1] - starts
+        new_offset = np.concatenate([[0], np.cumsum(lengths)])
+        taken.append(new_offset)
+        # Every position in the ranges starts:starts + lengths, in row order
+        index = np.arange(new_offset[-1]) + np.repeat(starts - new_offset[:-1], lengths)
+    return np.asarray(coords[index]), tuple(reversed(taken))
+
+
+def open_geometry_arrays(layer, region=crgp.LONDON, level=0):
+    # Get a layer's GeometryArrays, building the files on first use
+    arraydir = geometry_array_dir(layer, region, level)
+    if not os.path.exists(arraydir):
+        build_geometry_arrays(layer, region, level)
+    return GeometryArrays(arraydir)
+
+
+class GeometryArrays:
+    # Geometries of a layer as memory mapped coordinate and offset arrays.
+    # Processes that open the same files share one copy in the page cache, and
+    # shapely geometries or GeoJSON are only built for the rows being drawn
+
+    def __init__(self, arraydir):
+        with open(arraydir + '/index.json') as f:
+            index = json.load(f)
+        self.arraydir = arraydir
+        self.geometry_type = shapely.GeometryType(index['geometry_type'])
+        self.coords = np.load(arraydir + '/coords.npy', mmap_mode='r')
+        self.offsets = tuple(np.load(f'{arraydir}/offsets{i}.npy', mmap_mode='r')
+                             for i in range(index['offsets']))
+        self.key = index['key']
+        self.crs = index['crs']
+        self.frame = feather.read_feather(arraydir + '/attributes.feather')
+        self.codes = pd.Index(self.frame[self.key])
+        self.patch_coords = None    # Bokeh xs and ys, built on first use
+        self.join = (None, None)    # Data GeographyCodes, and the join index for them
+
+    def rows(self, codes):
+        rows = self.codes.get_indexer(codes)
+        if (rows < 0).any():
+            raise KeyError(np.asarray(codes)[rows < 0].tolist())
+        return rows
+
+    def join_index(self, data_codes):
+        # Row of data_codes for each feature, -1 where there is no data.
+        # Kept while tables have their geographies in the same order
+        data_codes = np.asarray(data_codes, dtype=object)
+        last_codes, join = self.join
+        if last_codes is None or not np.array_equal(last_codes, data_codes):
+            join = join_index(self.codes, data_codes)
+            self.join = (data_codes, join)
+        return join
+
+    def join_frame(self, df, columns):
+        # Key and lad11cd of the features that have data in df, with columns of
+        # df taken through the join index, instead of merging df onto the frame
+        join = self.join_index(df[LOCATION_COL])
+        present = np.flatnonzero(join >= 0)
+        data = {self.key: self.codes[present],
+                'lad11cd': self.frame['lad11cd'].to_numpy()[present]}
+        for column in columns:
+            data[column] = df[column].to_numpy()[join[present]]
+        return pd.DataFrame(data)
+
+    def geometries(self, rows=None):
+        # Shapely geometries of rows (default all), built from only their
+        # slices of the arrays on each call
+        if rows is None:
+            return shapely.from_ragged_array(self.geometry_type, self.coords, self.offsets)
+        coords, offsets = take_ragged(self.coords, self.offsets, rows)
+        return shapely.from_ragged_array(self.geometry_type, coords, offsets)
+
+    def attach(self, df, key):
+        # GeoDataFrame of df with the geometry of each row's df[key]
+        return gpd.GeoDataFrame(df, geometry=self.geometries(self.rows(df[key])),
+                                crs=self.crs)
+
+    def patches(self):
+        # Bokeh patches xs and ys of every feature: the exterior ring of each
+        # polygon, with polygons of a feature separated by NaN, as
+        # GeoJSONDataSource draws them. Single polygons are views of the arrays
+        if self.patch_coords is None:
+            ring_offsets = self.offsets[0]
+            polygon_rings = self.offsets[1][:-1]    # First ring is the exterior
+            if self.geometry_type == shapely.GeometryType.POLYGON:
+                geometry_polygons = np.arange(len(self.offsets[1]))
+            else:
+                geometry_polygons = self.offsets[2]
+            starts = ring_offsets[polygon_rings]
+            stops = ring_offsets[polygon_rings + 1]
+            xs = []
+            ys = []
+            gap = np.array([np.nan])
+            for first, last in zip(geometry_polygons[:-1], geometry_polygons[1:]):
+                if last - first == 1:
+                    xs.append(self.coords[starts[first]:stops[first], 0])
+                    ys.append(self.coords[starts[first]:stops[first], 1])
+                else:
+                    rings = [self.coords[start:stop] for start, stop in
+                             zip(starts[first:last], stops[first:last])]
+                    xs.append(np.concatenate(
+                        [part for ring in rings for part in (gap, ring[:, 0])][1:]))
+                    ys.append(np.concatenate(
+                        [part for ring in rings for part in (gap, ring[:, 1])][1:]))
+            self.patch_coords = (xs, ys)
+        return self.patch_coords
+
+    def column_data(self, df, key, columns):
+        # ColumnDataSource data of patches xs and ys for each row's df[key],
+        # with only the given columns of df
+        xs, ys = self.patches()
+        rows = self.rows(df[key])
+        data = {'xs': [xs[row] for row in rows], 'ys': [ys[row] for row in rows]}
+        for column in columns:
+            data[column] = df[column].to_numpy()
+        return data
+
+    def to_geojson(self, codes, properties, precision=None):
+        # GeoJSON FeatureCollection for codes, with the properties columns and
+        # coordinates snapped to precision decimal places if given
+        rows = self.rows(codes)
+        geometries = self.geometries(rows)
+        if precision is not None:
+            geometries = shapely.set_precision(geometries, 10**-precision)
+        props = self.frame[properties].iloc[rows].to_dict('records')
+        features = ','.join(
+            f'{{"type": "Feature", "properties": {json.dumps(p)}, "geometry": {g}}}'
+            for p, g in zip(props, shapely.to_geojson(geometries)))
+        return json.loads(f'{{"type": "FeatureCollection", "features": [{features}]}}')
+
+
+if __name__ == '__main__':
+    for layer in crgp.LAYERS:
+        for level in range(len(crgp.LEVEL_TOLERANCES)):
+            arrays = open_geometry_arrays(layer, level=level)
+            print(layer, level, arrays.coords.shape, len(arrays.codes))
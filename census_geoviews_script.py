@@ -1,5 +1,6 @@
 import census_read_data as crd
 import census_read_geopandas as crg
+import census_geometry_arrays as cga
 import pandas as pd
 import geoviews as gv
 from bokeh.plotting import show
@@ -29,8 +30,8 @@ df = crd.read_data(table_name)
 # Add names to data
 df = pd.merge(df, geography, on=locationcol)
 
-# Merge the data table (all data items) with the LAD geo data
-gdf = london_lads_gdf.merge(df, left_on='lad11cd', right_on=locationcol)
+# Add the mapped columns to the LAD geo data through a join index, no merge needed
+gdf = cga.attach_columns(london_lads_gdf, 'lad11cd', df, [locationcol, namecol, datacol])
 
 # Map data by LAD
 # Geoviews
@@ -0,0 +1,127 @@
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import census_read_data as crd
+
+workbook = None     # Workbook, opened once in each worker process
+
+
+def ingest_sheet(table_name):
+    # Worker: parse one Table sheet
+    global workbook
+    start = time.perf_counter()
+    if workbook is None:
+        workbook = pd.ExcelFile(crd.WORKBOOK)
+    tdf = crd.parse_sheet(workbook, table_name)
+    return tdf, time.perf_counter() - start
+
+
+def ingest_table(table_name, chunksize=None, prefix=None):
+    # Worker: parse one DATA.CSV, compact it and write its cache file
+    start = time.perf_counter()
+    key = crd.cache_data(table_name, chunksize, prefix)
+    return key, time.perf_counter() - start
+
+
+def ingest_all(workers=None, table_names=None, chunksize=None, prefix=None):
+    # Rebuild the catalog and data caches, fanning tables out to worker processes.
+    # Each table is added to the manifest as it completes, so a failed run can
+    # be resumed, and the catalog is written once every sheet has been parsed.
+    # chunksize and prefix are passed to cache_data, to stream large CSVs
+    digest = crd.workbook_hash()
+    catalog = crd.load_catalog(digest)
+    if catalog is None:
+        wb = pd.ExcelFile(crd.WORKBOOK)
+        index = crd.parse_index(wb)
+        wb.close()
+        tables = {}
+    else:
+        index = catalog['index']
+    all_table_names = list(index['Table Number'])
+    if table_names is None:
+        table_names = all_table_names
+
+    manifest = crd.read_manifest()
+    timings = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        if catalog is None:
+            for table_name in all_table_names:
+                futures[executor.submit(ingest_sheet, table_name)] = \
+                    (table_name, 'sheet')
+        for table_name in table_names:
+            if not crd.is_data_cached(table_name, manifest, prefix):
+                futures[executor.submit(ingest_table, table_name, chunksize, prefix)] = \
+                    (table_name, 'data')
+
+        for future in as_completed(futures):
+            table_name, step = futures[future]
+            try:
+                result, seconds = future.result()
+            except Exception as e:
+                timings.append((table_name, step, None, repr(e)))
+                continue
+            if step == 'sheet':
+                tables[table_name] = result
+            else:
+                crd.write_manifest({table_name: result})
+            timings.append((table_name, step, seconds, 'ok'))
+
+    if catalog is None and len(tables) == len(all_table_names):
+        crd.write_catalog({'index': index, 'tables': tables}, digest)
+
+    summary = pd.DataFrame(
+        timings, columns=['Table', 'Step', 'Seconds', 'Status'])
+    return summary.sort_values(['Step', 'Table'], ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Prepare the census catalog and data caches')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser(
+        'ingest-all', help='parse every table sheet and DATA.CSV in parallel')
+    ingest.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: number of CPUs)')
+    ingest.add_argument('--tables', nargs='*', default=None,
+                        help='only ingest the data of these tables')
+    ingest.add_argument('--chunksize', type=int, default=None,
+                        help='stream each DATA.CSV this many rows at a time')
+    ingest.add_argument('--prefix', nargs='+', default=None,
+                        help='only keep GeographyCodes starting with these prefixes')
+    tiles = commands.add_parser(
+        'build-tiles', help='write ward and LAD boundaries as vector tiles (MBTiles)')
+    tiles.add_argument('--region', default='',
+                       help='only tile LAD11CDs starting with this prefix (default: all)')
+    tiles.add_argument('--min-zoom', type=int, default=None,
+                       help='first zoom level (default: census_tiles.MIN_ZOOM)')
+    tiles.add_argument('--max-zoom', type=int, default=None,
+                       help='last zoom level (default: census_tiles.MAX_ZOOM)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build-tiles':
+        # Tiles need geopandas and mapbox-vector-tile, which ingest does not
+        import census_tiles as ctl
+        min_zoom = ctl.MIN_ZOOM if args.min_zoom is None else args.min_zoom
+        max_zoom = ctl.MAX_ZOOM if args.max_zoom is None else args.max_zoom
+        start = time.perf_counter()
+        tilesfile = ctl.build_tiles(args.region, min_zoom, max_zoom)
+        print(f'{tilesfile} written in {time.perf_counter() - start:.1f} seconds')
+        return 0
+
+    start = time.perf_counter()
+    summary = ingest_all(args.workers, args.tables,
+                         args.chunksize, args.prefix)
+    elapsed = time.perf_counter() - start
+    with pd.option_context('display.max_rows', None):
+        print(summary)
+    failed = summary['Status'] != 'ok'
+    print(f'{len(summary) - failed.sum()} steps ok, {failed.sum()} failed, '
+          f'{summary["Seconds"].sum():.1f} seconds of work in {elapsed:.1f} seconds')
+    return 1 if failed.any() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
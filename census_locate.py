@@ -0,0 +1,84 @@
+import os
+import pickle
+import numpy as np
+import shapely
+import census_read_geopandas as crgp
+
+LOCATOR_DIR = 'data/cache/locator'
+BATCH_SIZE = 1000000    # Points queried at a time, bounds memory for large inputs
+locators = {}
+
+
+def locator_file(region, epsg):
+    # Named after the ward layer's GeoParquet cache, so a changed shapefile gets a new index
+    cachefile = crgp.geometry_cache_file(
+        crgp.WARD_SHAPEFILE, crgp.region_key(region), epsg)
+    return LOCATOR_DIR + '/' + os.path.splitext(os.path.basename(cachefile))[0] + '.pickle'
+
+
+class WardLocator:
+    # Finds the ward and LAD containing points, using an STRtree over the ward
+    # geometries of a region (default all of England and Wales, see read_region)
+    # in epsg coordinates, e.g. 4326 for longitude and latitude or 27700 for
+    # easting and northing. The tree and codes are saved to disk on first use
+
+    def __init__(self, region='', epsg=4326):
+        filename = locator_file(region, epsg)
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                self.tree, self.ward_codes, self.lad_codes = pickle.load(f)
+        else:
+            gdf = crgp.read_region('ward', region, epsg=epsg)
+            self.tree = shapely.STRtree(gdf.geometry.values)
+            self.ward_codes = gdf['cmwd11cd'].to_numpy(dtype=str)
+            self.lad_codes = gdf['lad11cd'].to_numpy(dtype=str)
+            os.makedirs(LOCATOR_DIR, exist_ok=True)
+            tmpfile = f'{filename}.tmp{os.getpid()}'
+            with open(tmpfile, 'wb') as f:
+                pickle.dump((self.tree, self.ward_codes, self.lad_codes), f)
+            os.replace(tmpfile, filename)
+
+    def locate_rows(self, x, y):
+        # Ward row for each point, -1 outside every ward. A point on a border
+        # goes to the first ward containing it
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        rows = np.full(len(x), -1)
+        for start in range(0, len(x), BATCH_SIZE):
+            stop = start + BATCH_SIZE
+            points = shapely.points(x[start:stop], y[start:stop])
+            point_rows, ward_rows = self.tree.query(points, predicate='intersects')
+            order = np.lexsort((ward_rows, point_rows))
+            point_rows, first = np.unique(point_rows[order], return_index=True)
+            rows[start + point_rows] = ward_rows[order][first]
+        return rows
+
+    def locate(self, x, y):
+        # CMWD11CD and LAD11CD arrays for points, '' outside every ward
+        rows = self.locate_rows(x, y)
+        inside = rows >= 0
+        wards = np.full(len(rows), '', dtype=self.ward_codes.dtype)
+        lads = np.full(len(rows), '', dtype=self.lad_codes.dtype)
+        wards[inside] = self.ward_codes[rows[inside]]
+        lads[inside] = self.lad_codes[rows[inside]]
+        return wards, lads
+
+
+def locate(x, y, epsg=4326, region=''):
+    # CMWD11CD and LAD11CD arrays for points, using a WardLocator per region and CRS
+    if (region, epsg) not in locators:
+        locators[(region, epsg)] = WardLocator(region, epsg)
+    return locators[(region, epsg)].locate(x, y)
+
+
+if __name__ == '__main__':
+    import time
+    locator = WardLocator()
+    bounds = crgp.union_bbox(shapely.bounds(locator.tree.geometries))
+    rng = np.random.default_rng(0)
+    x = rng.uniform(bounds[0], bounds[2], 1000000)
+    y = rng.uniform(bounds[1], bounds[3], 1000000)
+    start = time.perf_counter()
+    wards, lads = locator.locate(x, y)
+    print(f'{len(x)} points located in {time.perf_counter() - start:.1f} seconds')
+    print(wards[:5], lads[:5])
@@ -7,6 +7,7 @@ import panel as pn
 
 # Get Census Merged Ward and Local Authority Data
 geography = crd.read_geography()
+geography_lookup = crd.Geography(geography)
 locationcol = "GeographyCode"
 namecol = "Name"
 
@@ -46,15 +47,14 @@ lad_max_value = london_lads_data_gdf[datacol].max()
 ward_max_value = london_wards_data_gdf[datacol].max()
 title = datacol + " by Local Authority"
 
-local_authorities = geography['LAD11CD'].unique()
+local_authorities = geography_lookup.lad_codes
 granularities = ['Local Authorities', 'Wards']
 
 # Create Widgets
 granularity_widget = pn.widgets.RadioButtonGroup(options=granularities)
 local_authority_widget = pn.widgets.Select(name='Wards for Local Authority',
                                            options=['All'] +
-                                           [geography[geography[locationcol] == lad][namecol].iat[0]
-                                            for lad in local_authorities],
+                                           geography_lookup.names_for(local_authorities).tolist(),
                                            value='All')
 widgets = pn.Column(granularity_widget, local_authority_widget)
 layout = widgets
@@ -76,8 +76,8 @@ def update_graph(event):
             gdf = london_wards_data_gdf
             title = datacol + " by Ward"
         else:
-            local_authority_id = geography[geography['Name'] ==
-                                           local_authority_name].iloc[0]['GeographyCode']
+            local_authority_id = geography_lookup.lad_code_for(
+                local_authority_name)
             gdf = london_wards_data_gdf[london_wards_data_gdf['lad11cd'].str.match(
                 local_authority_id)]
             title = datacol + " by Ward for " + local_authority_name
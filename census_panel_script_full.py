@@ -1,5 +1,6 @@
 import census_read_data as crd
 import census_read_geopandas as crg
+import census_geometry_arrays as cga
 import pandas as pd
 import geoviews as gv
 from bokeh.models import PrintfTickFormatter
@@ -8,14 +9,27 @@ import param
 
 # Get Census Merged Ward and Local Authority Data
 geography = crd.read_geography()
+geography_lookup = crd.Geography(geography)
 locationcol = "GeographyCode"
 namecol = "Name"
 
-# Get London Ward GeoPandas DataFrame
-london_wards_gdf = crg.read_london_ward_geopandas()
+# Ward and LAD geometries at every level of simplification, level 0 is full
+# resolution. They are memory mapped, so worker processes share one copy
+levels = range(len(crg.LEVEL_TOLERANCES))
+london_wards_levels = [cga.open_geometry_arrays('ward', level=level) for level in levels]
+london_lads_levels = [cga.open_geometry_arrays('lad', level=level) for level in levels]
 
-# Get LAD GeoPandas DataFrame
-london_lads_gdf = crg.read_london_lad_geopandas()
+# Ward and LAD attributes, geometries are attached when a map is drawn
+london_wards_df = london_wards_levels[0].frame
+london_lads_df = london_lads_levels[0].frame
+
+# Bounding boxes of each ward and LAD, and of London
+london_ward_bounds = crg.read_bounds('ward')
+london_lad_bounds = crg.read_bounds('lad')
+
+# Only London data is needed
+london_ids = london_wards_df['cmwd11cd'].tolist() + \
+    london_lads_df['lad11cd'].tolist()
 
 # Get Census data index and its table_names
 index = crd.read_index()
@@ -23,7 +37,7 @@ table_names = crd.get_table_names(index)
 
 # Panel
 
-local_authorities = geography['LAD11CD'].unique()
+local_authorities = london_lads_df['lad11cd'].tolist()
 granularities = ['Local Authorities', 'Wards']
 
 empty_map = pn.pane.Markdown('''
@@ -45,16 +59,14 @@ class MapViewer(param.Parameterized):
         default=granularities[0], objects=granularities, precedence=6)
     local_authority_name = param.Selector(
         default='All', objects=['All'] +
-        [geography[geography[locationcol] == lad][namecol].iat[0]
-         for lad in local_authorities],
+        geography_lookup.names_for(local_authorities).tolist(),
         precedence=7)
 
     def __init__(self, **params):
         super().__init__(**params)
         self.tdf = None                     # DataFrame for current table
         self.categories = None              # Category name and options for current table
-        self.london_lads_data_gdf = None    # Local authority data for current selection
-        self.london_wards_data_gdf = None   # Ward  data for current selection
+        self.df = None                      # Data for current table
 
     def update_categories(self, visible):
         if self.categories is None:
@@ -81,15 +93,10 @@ class MapViewer(param.Parameterized):
             table[0] for table in table_names if table[1] == self.table_name][0]
         self.tdf = crd.read_table(self.table_code)
         self.categories = crd.get_table_column_names_and_values(self.tdf)
-        df = crd.read_data(self.table_code)
+        df = crd.read_data(self.table_code, geographies=london_ids, compact=True)
         # Add names to data
-        df = pd.merge(df, geography, on=locationcol)
-
-        # Merge the data table (all data items) with the geo data
-        self.london_lads_data_gdf = london_lads_gdf.merge(
-            df, left_on='lad11cd', right_on=locationcol)
-        self.london_wards_data_gdf = london_wards_gdf.merge(
-            df, left_on='cmwd11cd', right_on=locationcol)
+        self.df = crd.compact_frame(pd.merge(df, geography, on=locationcol))
+        crd.track_frame('London ' + self.table_code, self.df)
 
         for p in self.category_names:
             index = int(p[-1]) - 1
@@ -108,36 +115,45 @@ class MapViewer(param.Parameterized):
                                      for p in self.param if p in self.active_categories()]:
             return empty_map
 
-        # Get category values as query string
-        query_categories = []
-        for i, category in enumerate(self.categories):
-            category_param = f'category{i+1}'
-            category_value = getattr(self, category_param)
-            query_categories.append(f'`{category[0]}` == "{category_value}"')
-        query_string = " & ".join(query_categories)
-
-        trow = self.tdf.query(query_string)
-        datacol = self.table_code + trow.iloc[0, -1]
-        lad_max_value = self.london_lads_data_gdf[datacol].max()
-        ward_max_value = self.london_wards_data_gdf[datacol].max()
+        # Get category values, and the dataset for them
+        category_values = [getattr(self, f'category{i+1}')
+                           for i in range(len(self.categories))]
+        datacol = self.table_code + \
+            crd.resolve_dataset(self.table_code, category_values)
+        # Take the columns the map uses for each ward and LAD through the
+        # layers' join indexes, rather than merging the table onto them
+        columns = [locationcol, namecol, datacol, 'LAD11NM']
+        london_lads_data_df = london_lads_levels[0].join_frame(self.df, columns)
+        london_wards_data_df = london_wards_levels[0].join_frame(self.df, columns)
+        lad_max_value = london_lads_data_df[datacol].max()
+        ward_max_value = london_wards_data_df[datacol].max()
         title = datacol + " by Local Authority"
 
         if self.granularity == 'Local Authorities':
-            gdf = self.london_lads_data_gdf
+            fdf = london_lads_data_df
+            key, geometry_levels = 'lad11cd', london_lads_levels
+            bbox = london_lad_bounds.bbox
             max_value = lad_max_value
             title = datacol + " by Local Authority"
         else:
+            key, geometry_levels = 'cmwd11cd', london_wards_levels
             max_value = ward_max_value
             if self.local_authority_name == 'All':
-                gdf = self.london_wards_data_gdf
+                fdf = london_wards_data_df
+                bbox = london_ward_bounds.bbox
                 title = datacol + " by Ward"
             else:
-                local_authority_id = geography[geography['Name'] ==
-                                               self.local_authority_name].iloc[0]['GeographyCode']
-                gdf = self.london_wards_data_gdf[self.london_wards_data_gdf['lad11cd'].str.match(
+                local_authority_id = geography_lookup.lad_code_for(
+                    self.local_authority_name)
+                fdf = london_wards_data_df[london_wards_data_df['lad11cd'].str.match(
                     local_authority_id)]
+                bbox = london_ward_bounds.lad_bbox(local_authority_id)
                 title = datacol + " by Ward for " + self.local_authority_name
 
+        # Draw the simplest level that is still accurate to a pixel
+        level = crg.level_for_extent(bbox, pixels=900)
+        gdf = geometry_levels[level].attach(fdf, key)
+
         map = gv.Polygons(
             gdf, vdims=[locationcol, namecol, datacol, 'LAD11NM'])
         map.opts(title=title,
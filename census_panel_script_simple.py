@@ -8,6 +8,7 @@ import param
 
 # Get Census Merged Ward and Local Authority Data
 geography = crd.read_geography()
+geography_lookup = crd.Geography(geography)
 locationcol = "GeographyCode"
 namecol = "Name"
 
@@ -45,7 +46,7 @@ lad_max_value = london_lads_data_gdf[datacol].max()
 ward_max_value = london_wards_data_gdf[datacol].max()
 title = datacol + " by Local Authority"
 
-local_authorities = geography['LAD11CD'].unique()
+local_authorities = geography_lookup.lad_codes
 granularities = ['Local Authorities', 'Wards']
 
 
@@ -55,8 +56,7 @@ class MapViewer(param.Parameterized):
         default=granularities[0], objects=granularities)
     local_authority_name = param.Selector(
         default='All', objects=['All'] +
-        [geography[geography[locationcol] == lad][namecol].iat[0]
-         for lad in local_authorities])
+        geography_lookup.names_for(local_authorities).tolist())
 
     @param.depends('granularity', 'local_authority_name')
     def view(self):
@@ -71,8 +71,8 @@ class MapViewer(param.Parameterized):
                 gdf = london_wards_data_gdf
                 title = datacol + " by Ward"
             else:
-                local_authority_id = geography[geography['Name'] ==
-                                               self.local_authority_name].iloc[0]['GeographyCode']
+                local_authority_id = geography_lookup.lad_code_for(
+                    self.local_authority_name)
                 gdf = london_wards_data_gdf[london_wards_data_gdf['lad11cd'].str.match(
                     local_authority_id)]
                 title = datacol + " by Ward for " + self.local_authority_name
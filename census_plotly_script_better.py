@@ -2,16 +2,14 @@ import census_read_data as crd
 import census_read_geojson as crg
 import pandas as pd
 import plotly.express as px
-from turfpy.measurement import bbox
-from functools import reduce
 
 # Get Census Merged Ward and Local Authority Data
 geography = crd.read_geography()
 locationcol = "GeographyCode"
 namecol = "Name"
 
-# Get LAD GeoJSON
-london_lads = crg.read_london_lad_geojson()
+# Get LAD GeoJSON, quantized for the browser
+london_lads = crg.quantize_geojson(crg.read_london_lad_geojson(), keep=['lad11cd'])
 london_lad_ids = list(map(lambda f: f['properties']
                           ['lad11cd'], london_lads["features"]))
 
@@ -40,18 +38,7 @@ max_value = london_lad_df[datacol].max()
 title = datacol + " by Local Authority"
 
 
-def compute_bbox(gj):
-    # Compute bounding box for GeoJSON
-    gj_bbox_list = list(
-        map(lambda f: bbox(f['geometry']), gj['features']))
-    gj_bbox = reduce(
-        lambda b1, b2: [min(b1[0], b2[0]), min(b1[1], b2[1]),
-                        max(b1[2], b2[2]), max(b1[3], b2[3])],
-        gj_bbox_list)
-    return gj_bbox
-
-
-gj_bbox = compute_bbox(london_lads)
+gj_bbox = crg.read_london_bounds('lad').bbox
 
 fig = px.choropleth(london_lad_df,
                     geojson=london_lads,
@@ -1,138 +1,429 @@
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import threading
+import weakref
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
 
 CENSUS_DATA = 'data/BulkdatadetailedcharacteristicsmergedwardspluslaandregE&Wandinfo3.3'
-f = None
+WORKBOOK = CENSUS_DATA+'/Cell Numbered DC Tables 3.3.xlsx'
+CATALOG_FILE = 'data/cache/catalog.pickle'
+DATA_CACHE = 'data/cache/data'
+MANIFEST_FILE = DATA_CACHE + '/manifest.json'
+DATA_CHUNKSIZE = None   # Rows streamed at a time when read_data converts a CSV, None for all
+ALL_CATEGORIES = "All categories: "
+COL_HEAD_ROW = 6
+LOCATION_COL = 'GeographyCode'
+NAME_COL = 'Name'
 
 
-def read_index():
-    # Read Index sheet
-    global f
-    excel_file = CENSUS_DATA+'/Cell Numbered DC Tables 3.3.xlsx'
-    f = pd.ExcelFile(excel_file)
-    index = f.parse(sheet_name='Index')
+def workbook_hash():
+    sha = hashlib.sha256()
+    with open(WORKBOOK, 'rb') as wb:
+        for block in iter(lambda: wb.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def read_catalog():
+    # Read the table catalog, rebuilding it if the workbook has changed
+    digest = workbook_hash()
+    cached = load_catalog(digest)
+    if cached is None:
+        cached = build_catalog()
+        write_catalog(cached, digest)
+    return cached
+
+
+def load_catalog(digest):
+    # Cached catalog, if it was built from the workbook with this hash
+    if not os.path.exists(CATALOG_FILE):
+        return None
+    with open(CATALOG_FILE, 'rb') as cf:
+        cached = pickle.load(cf)
+    return cached if cached['hash'] == digest else None
+
+
+def write_catalog(cached, digest):
+    cached['hash'] = digest
+    os.makedirs(os.path.dirname(CATALOG_FILE), exist_ok=True)
+    tmpfile = f'{CATALOG_FILE}.tmp{os.getpid()}'
+    with open(tmpfile, 'wb') as cf:
+        pickle.dump(cached, cf, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpfile, CATALOG_FILE)
+
+
+def build_catalog():
+    # Parse the Index sheet and every Table sheet of the workbook
+    wb = pd.ExcelFile(WORKBOOK)
+    index = parse_index(wb)
+    tables = {}
+    for table_name in index['Table Number']:
+        tables[table_name] = parse_sheet(wb, table_name)
+    wb.close()
+    return {'index': index, 'tables': tables}
+
+
+def parse_index(wb):
+    index = wb.parse(sheet_name='Index')
     index.drop(columns='Type of Table', inplace=True)
     return index
 
 
-def read_table(table_name):
-    # Read Table sheet, transforming it into a DataFrame with columns
-    # for each category and the Dataset index
-    if f == None:
-        exit("Call read_index() to open table list")
-    table = f.parse(sheet_name=table_name, header=None)
+def parse_sheet(wb, table_name):
+    table = wb.parse(sheet_name=table_name, header=None)
+    return parse_table(table.to_numpy(dtype=object))
+
+
+def last_present(present):
+    # Position of the most recent True at each position of a boolean array
+    return np.maximum.accumulate(np.where(present, np.arange(len(present)), 0))
+
+
+def level_values(row_heads, is_level, is_data):
+    # Headings of one row level, with the latest heading repeated for each
+    # data row that has no new heading at this level
+    data_count = np.arange(1, is_data.sum()+1)
+    level_count = np.cumsum(is_level)[is_data]
+    repeats = np.maximum.accumulate(np.maximum(data_count - level_count, 0))
+    is_repeat = np.zeros_like(is_data)
+    is_repeat[is_data] = np.diff(repeats, prepend=0) > 0
+    return row_heads[last_present(is_level)][is_level | is_repeat]
+
+
+def parse_table(cells):
+    # Parse Table sheet cells, held as a NumPy object array
+    blank = pd.isna(cells)
+
     # Column headings start at row 6, upto row that has data in column 0
-    ALL_CATEGORIES = "All categories: "
-    COL_HEAD_ROW = 6
-    row = COL_HEAD_ROW
-    while pd.isna(table.iloc[row, 0]):
-        row += 1
+    col_levels = np.argmax(~blank[COL_HEAD_ROW:, 0])
     # Previous row has column names, earlier rows (if any) have hierarchy
-    col_levels = row - COL_HEAD_ROW
+    heads = cells[COL_HEAD_ROW:COL_HEAD_ROW+col_levels, 1:]
+    heads_blank = blank[COL_HEAD_ROW:COL_HEAD_ROW+col_levels, 1:]
+    heads_all = np.char.startswith(heads.astype(str), ALL_CATEGORIES)
+    # Level names are taken in column order
     col_level_names = []
-    col_level_values = [[] for _ in range(col_levels)]
-    col = 1
-    row = COL_HEAD_ROW
-    while col < len(table.columns):
-        for r in range(col_levels):
-            if pd.isna(table.iloc[row+r, col]):
-                col_level_values[r].append(col_level_values[r][-1])
-            else:
-                value = table.iloc[row+r, col]
-                if value.startswith(ALL_CATEGORIES):
-                    category = value[len(ALL_CATEGORIES):]
-                    value = 'All'
-                    if len(col_level_names) <= r:
-                        col_level_names.append(category)
-                col_level_values[r].append(value)
-        col += 1
+    for col, r in zip(*np.nonzero(heads_all.T)):
+        if len(col_level_names) <= r:
+            col_level_names.append(heads[r, col][len(ALL_CATEGORIES):])
+    heads = np.where(heads_all, 'All', heads)
+    # Blank headings continue the heading to their left
+    col_level_values = [heads[r][last_present(~heads_blank[r])]
+                        for r in range(col_levels)]
 
     # Row headings start after column headings, last level has data in column 1
     ROW_HEAD_ROW = COL_HEAD_ROW+col_levels
-    row = ROW_HEAD_ROW
-    while pd.isna(table.iloc[row, 1]):
-        row += 1
-    # This row has row name, earlier rows (if any) have hierarchy
-    row_levels = row + 1 - ROW_HEAD_ROW
-    row_level_names = []
-    row_level_values = [[] for _ in range(row_levels)]
-    row = ROW_HEAD_ROW
-    level = -1
-    wasLevel = True
-    data_row_indexes = []
-    while row < len(table.index) and not pd.isna(table.iloc[row, 0]):
-        if wasLevel or pd.isna(table.iloc[row, 1]):
-            level += 1
-            if level >= row_levels:
-                level = 0
-            if pd.isna(table.iloc[row, 1]):
-                wasLevel = True
-            else:
-                wasLevel = False
-        value = table.iloc[row, 0]
-        if value.startswith(ALL_CATEGORIES):
-            category = value[len(ALL_CATEGORIES):]
-            value = 'All'
-            if len(row_level_names) < row_levels:
-                row_level_names.append(category)
-        row_level_values[level].append(value)
-        if level+1 == row_levels:
-            for l in range(level):
-                if len(row_level_values[l]) < len(row_level_values[level]):
-                    row_level_values[l].append(row_level_values[l][-1])
-            data_row_indexes.append(row)
-        row += 1
+    row_levels = np.argmax(~blank[ROW_HEAD_ROW:, 1]) + 1
+    # Row headings continue upto the first row without data in column 0
+    ends = np.flatnonzero(blank[ROW_HEAD_ROW:, 0])
+    num_heads = ends[0] if len(ends) > 0 else len(cells) - ROW_HEAD_ROW
+    row_heads = cells[ROW_HEAD_ROW:ROW_HEAD_ROW+num_heads, 0]
+    row_heads_all = np.char.startswith(row_heads.astype(str), ALL_CATEGORIES)
+    row_level_names = [head[len(ALL_CATEGORIES):]
+                       for head in row_heads[row_heads_all][:row_levels]]
+    row_heads = np.where(row_heads_all, 'All', row_heads)
+    # Rows without data start a level, and the row after one is the next level
+    is_level = blank[ROW_HEAD_ROW:ROW_HEAD_ROW+num_heads, 1]
+    advance = is_level | np.concatenate([[True], is_level[:-1]])
+    levels = (np.cumsum(advance) - 1) % row_levels
+    # Rows at the last level have data
+    is_data = levels == row_levels-1
+    data_rows = np.flatnonzero(is_data)
+    row_level_values = [level_values(row_heads, levels == l, is_data)
+                        for l in range(row_levels-1)] + [row_heads[data_rows]]
 
     # Construct DataFrame from column and row level names and values
     num_cols = len(col_level_values[0])
     num_rows = len(row_level_values[0])
-    for l in range(row_levels):
-        # Repeat row values in order
-        row_level_values[l] = [x for x in row_level_values[l]
-                               for n in range(num_cols)]
-    for l in range(col_levels):
-        # Repeat col values in turn
-        col_level_values[l] = col_level_values[l] * num_rows
-    values = []
-    for r in range(0, num_rows):
-        row = data_row_indexes[r]
-        values.extend(table.iloc[row, 1:])
-    values = [str(int).zfill(4) for int in values]
-    data = [row_level_values[l] for l in range(row_levels)] + \
-           [col_level_values[l] for l in range(col_levels)] + \
+    values = cells[ROW_HEAD_ROW+data_rows[:num_rows], 1:].ravel()
+    values = np.char.zfill(values.astype(str), 4).astype(object)
+    data = [np.repeat(row_level_values[l], num_cols) for l in range(row_levels)] + \
+           [np.tile(col_level_values[l], num_rows) for l in range(col_levels)] + \
         [values]
     index = row_level_names+col_level_names+['Dataset']
+    if len(set(map(len, data))) > 1:
+        # Irregular row hierarchy, columns are padded with missing values
+        return pd.DataFrame(data=data, index=index).transpose()
     df = pd.DataFrame(
-        data=data,
-        index=index
+        data=np.column_stack(data),
+        columns=index
     )
-    df = df.transpose()
     return df
 
 
-def read_data(table_name):
-    datafile = CENSUS_DATA + '/' + table_name + 'DATA.CSV'
-    df = pd.read_csv(datafile)
+def data_file(table_name):
+    return CENSUS_DATA + '/' + table_name + 'DATA.CSV'
+
+
+def data_cache_file(table_name):
+    return DATA_CACHE + '/' + table_name + '.feather'
+
+
+def source_key(datafile):
+    # Cache entries are keyed by the size and mtime of the source CSV
+    stat = os.stat(datafile)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def read_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE) as mf:
+        return json.load(mf)
+
+
+def write_manifest(entries):
+    # Merge table entries into the manifest on disk, re-read just before
+    # writing so entries written meanwhile by other processes are kept.
+    # Written to a temporary file and renamed, so readers never see a partial file
+    os.makedirs(DATA_CACHE, exist_ok=True)
+    manifest = read_manifest()
+    manifest.update(entries)
+    tmpfile = f'{MANIFEST_FILE}.tmp{os.getpid()}'
+    with open(tmpfile, 'w') as mf:
+        json.dump(manifest, mf, indent=1, sort_keys=True)
+    os.replace(tmpfile, MANIFEST_FILE)
+    return manifest
+
+
+def is_source_current(entry, datafile):
+    # Manifest entry matches the size and mtime of the source CSV
+    key = source_key(datafile)
+    return entry is not None and all(entry.get(k) == v for k, v in key.items())
+
+
+def prefix_key(prefix):
+    # Manifest form of a GeographyCode prefix, a list of prefixes or None for all rows
+    if prefix is None:
+        return None
+    return [prefix] if isinstance(prefix, str) else list(prefix)
+
+
+def is_cache_current(table_name, entry):
+    # Cache file exists and its manifest entry matches the source CSV
+    datafile = data_file(table_name)
+    return os.path.exists(datafile) and \
+        is_source_current(entry, datafile) and \
+        os.path.exists(data_cache_file(table_name))
+
+
+def is_data_cached(table_name, manifest, prefix=None):
+    # Cache file is current and was filtered with the same prefix, so an
+    # ingest with a prefix is rebuilt by a read of all rows, and vice versa
+    entry = manifest.get(table_name)
+    return is_cache_current(table_name, entry) and \
+        entry.get('prefix') == prefix_key(prefix)
+
+
+def is_data_readable(table_name, manifest, geographies=None):
+    # Cache file is current and holds the rows of geographies (default all),
+    # so a cache ingested with a prefix serves reads of matching codes
+    entry = manifest.get(table_name)
+    if not is_cache_current(table_name, entry):
+        return False
+    prefix = entry.get('prefix')
+    if prefix is None:
+        return True
+    return geographies is not None and \
+        pd.Series(geographies, dtype=str).str.startswith(tuple(prefix)).all()
+
+
+def cache_data(table_name, chunksize=None, prefix=None):
+    # Convert table DATA.CSV to Feather, returning its manifest entry.
+    # Only GeographyCodes starting with prefix (a string or tuple) are kept.
+    # With chunksize, the CSV is streamed that many rows at a time, and each
+    # chunk is written as it is read, so memory does not grow with the file
+    datafile = data_file(table_name)
+    key = source_key(datafile)
+    os.makedirs(DATA_CACHE, exist_ok=True)
+    # Uncompressed, so that reads can be memory mapped. Renamed into place,
+    # so open memory maps keep the previous file
+    cachefile = data_cache_file(table_name)
+    tmpfile = f'{cachefile}.tmp{os.getpid()}'
+    chunks = read_csv_chunks(datafile, chunksize, prefix)
+    if chunksize is None:
+        df = next(chunks).reset_index(drop=True)
+        # Integers are stored in their narrowest type, and widened again on read
+        df = df.astype(integer_types(df))
+        df.to_feather(tmpfile, compression='uncompressed')
+    else:
+        write_feather_chunks(tmpfile, chunks, pd.read_csv(datafile, nrows=0))
+    os.replace(tmpfile, cachefile)
+    if prefix is not None:
+        key['prefix'] = prefix_key(prefix)
+    return key
+
+
+def read_csv_chunks(filename, chunksize, prefix=None, column=LOCATION_COL, usecols=None):
+    # Yield DataFrames of at most chunksize rows (or the whole file if chunksize
+    # is None), keeping only rows where column starts with prefix
+    if prefix is not None and not isinstance(prefix, str):
+        prefix = tuple(prefix)
+    if chunksize is None:
+        chunks = [pd.read_csv(filename, usecols=usecols)]
+    else:
+        chunks = pd.read_csv(filename, usecols=usecols, chunksize=chunksize)
+    for chunk in chunks:
+        if prefix is not None:
+            chunk = chunk[chunk[column].str.startswith(prefix)]
+        yield chunk
+    if chunksize is not None:
+        chunks.close()
+
+
+def write_feather_chunks(filename, chunks, header=None):
+    # Write DataFrame chunks to one Feather file as record batches.
+    # The schema comes from the first chunk, with integers stored as int32,
+    # which raises if a later value does not fit. With no chunks, an empty
+    # file is written with the columns of header, e.g. the CSV's header row
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            schema = feather_chunk_schema(table.schema)
+            writer = pa.ipc.new_file(filename, schema)
+        writer.write_table(table.cast(schema))
+    if writer is None:
+        table = pa.Table.from_pandas(header, preserve_index=False)
+        schema = feather_chunk_schema(table.schema)
+        writer = pa.ipc.new_file(filename, schema)
+    writer.close()
+
+
+def feather_chunk_schema(schema):
+    # GeographyCode as strings, and data counts (untyped when empty) as int32
+    return pa.schema([
+        field.with_type(pa.string()) if field.name == LOCATION_COL else
+        field.with_type(pa.int32()) if pa.types.is_integer(field.type) or
+        pa.types.is_null(field.type) else
+        field
+        for field in schema])
+
+
+def ingest_data(table_names, chunksize=None, prefix=None):
+    # One-time conversion of DATA.CSV files that are missing or stale in the cache
+    manifest = read_manifest()
+    entries = {}
+    for table_name in table_names:
+        if not is_data_cached(table_name, manifest, prefix):
+            entries[table_name] = cache_data(table_name, chunksize, prefix)
+    return write_manifest(entries)
+
+
+def read_csv_data(table_name, columns, geographies):
+    df = pd.read_csv(data_file(table_name), usecols=columns)
+    if columns is not None:
+        df = df[columns]
+    if geographies is not None:
+        df = df[df[LOCATION_COL].isin(geographies)].reset_index(drop=True)
+    return df
+
+
+def read_cached_data(table_name, columns, geographies, compact):
+    table = feather.read_table(data_cache_file(table_name),
+                               columns=columns, memory_map=True)
+    if geographies is not None:
+        # Filter in Arrow, so only the selected rows are materialized
+        table = table.filter(pc.is_in(table[LOCATION_COL],
+                                      value_set=pa.array(geographies, pa.string())))
+    if not compact:
+        table = table.cast(pa.schema([
+            field.with_type(pa.int64()) if pa.types.is_integer(field.type) else field
+            for field in table.schema]))
+    df = table.to_pandas()
     return df
 
 
-def read_geography():
-    # Get Census Merged Ward and Local Authority Data
+def integer_types(df):
+    # Narrowest safe integer type for each integer column
+    types = {}
+    ints = df.select_dtypes(include='integer')
+    if len(ints.columns) > 0 and len(ints) > 0:
+        mins, maxs = ints.min(), ints.max()
+        for col in ints.columns:
+            for dtype in [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32]:
+                info = np.iinfo(dtype)
+                if mins[col] >= info.min and maxs[col] <= info.max:
+                    types[col] = dtype
+                    break
+    return types
+
+
+def compact_frame(df):
+    # Narrowest safe integer type for each integer column,
+    # and categories for code and name columns
+    types = integer_types(df)
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        types[col] = 'category'
+    return df.astype(types)
+
+
+def read_geography(chunksize=None, prefix=None):
+    # Get Census Merged Ward and Local Authority Data, reading the lookup once.
+    # Only LAD11CDs starting with prefix are kept, and with chunksize the lookup
+    # is streamed, so memory depends on the rows kept rather than the file
     lookupfile = 'data/Ward_to_Census_Merged_Ward_to_Local_Authority_District_(December_2011)_Lookup_in_England_and_Wales.csv'
-    cmwd = pd.read_csv(lookupfile, usecols=[
+    chunks = read_csv_chunks(lookupfile, chunksize, prefix, 'LAD11CD', usecols=[
         'CMWD11CD', 'CMWD11NM', 'LAD11CD', 'LAD11NM'])
-    cmwd.drop_duplicates(inplace=True)
+    lookup = pd.concat([chunk.drop_duplicates() for chunk in chunks])
+    cmwd = lookup.drop_duplicates().copy()
     locationcol = "GeographyCode"
     cmwd[locationcol] = cmwd['CMWD11CD']
     namecol = 'Name'
     cmwd[namecol] = cmwd['CMWD11NM']
-    lad = pd.read_csv(lookupfile, usecols=['LAD11CD', 'LAD11NM'])
-    lad = lad.drop_duplicates()
+    lad = lookup[['LAD11CD', 'LAD11NM']].drop_duplicates().copy()
     lad[locationcol] = lad['LAD11CD']
     lad[namecol] = lad['LAD11NM']
     lad['CMWD11CD'] = ''
     lad['CMWD11NM'] = ''
     geography = pd.concat([cmwd, lad])
-    return geography
+    # Categories hold one copy of each code and name
+    return geography.astype('category')
+
+
+class Geography:
+    # Lookups over read_geography() rows, by GeographyCode and LAD name
+
+    def __init__(self, geography):
+        self.geography = geography
+        self.codes = pd.Index(geography[LOCATION_COL].astype(str))
+        self.frame = geography.set_index(self.codes)
+        self.names = geography[NAME_COL].to_numpy(dtype=object)
+        # Ward to LAD, LADs map to themselves
+        self.lads = geography['LAD11CD'].to_numpy(dtype=object)
+        is_lad = (geography['CMWD11CD'] == '').to_numpy()
+        self.lad_codes = self.codes[is_lad]
+        self.lad_names = pd.Index(self.names[is_lad])
+
+    def positions(self, codes):
+        positions = self.codes.get_indexer(codes)
+        if (positions < 0).any():
+            raise KeyError(np.asarray(codes)[positions < 0].tolist())
+        return positions
+
+    def names_for(self, codes):
+        return self.names[self.positions(codes)]
+
+    def name_for(self, code):
+        return self.names_for([code])[0]
+
+    def lads_for(self, codes):
+        return self.lads[self.positions(codes)]
+
+    def lad_codes_for(self, names):
+        positions = self.lad_names.get_indexer(names)
+        if (positions < 0).any():
+            raise KeyError(np.asarray(names)[positions < 0].tolist())
+        return self.lad_codes[positions].to_numpy(dtype=object)
+
+    def lad_code_for(self, name):
+        return self.lad_codes_for([name])[0]
 
 
 def get_table_names(index):
@@ -153,6 +444,133 @@ def get_table_column_names_and_values(tdf):
     return [(col, tdf[col].unique().tolist()) for col in get_table_columns(tdf)]
 
 
+class CensusReader:
+    # Reads census tables and data, owning the table catalog and caches.
+    # Methods may be called concurrently, e.g. from a thread pool
+
+    def __init__(self, chunksize=DATA_CHUNKSIZE):
+        self.chunksize = chunksize     # Passed to cache_data by read_data
+        self.lock = threading.RLock()
+        self.catalog = None
+        self.dataset_indexes = {}
+        self.tracked_frames = {}    # Live frames for memory_report, name and weakref
+        self.frame_ids = itertools.count()
+
+    def read_index(self):
+        # Read Index from the table catalog, reloading the catalog
+        with self.lock:
+            self.catalog = read_catalog()
+            self.dataset_indexes = {}
+            return self.catalog['index'].copy()
+
+    def get_catalog(self):
+        # Catalog is loaded on first use
+        catalog = self.catalog
+        if catalog is None:
+            with self.lock:
+                if self.catalog is None:
+                    self.catalog = read_catalog()
+                catalog = self.catalog
+        return catalog
+
+    def read_table(self, table_name):
+        # Read Table from the catalog, a DataFrame with columns
+        # for each category and the Dataset index. A copy, so callers cannot
+        # change the shared catalog
+        return self.get_catalog()['tables'][table_name].copy()
+
+    def read_data(self, table_name, columns=None, geographies=None, cache=True, compact=False):
+        # Read table data, optionally only the given data columns and geography codes.
+        # GeographyCode is always included, and cache=False reads the CSV directly.
+        # compact=True narrows the column types, see compact_frame, and tracks
+        # the frame for memory_report
+        if columns is not None:
+            columns = [LOCATION_COL] + \
+                [col for col in columns if col != LOCATION_COL]
+        if cache:
+            self.update_data_cache(table_name, geographies)
+            df = read_cached_data(table_name, columns, geographies, compact)
+        else:
+            df = read_csv_data(table_name, columns, geographies)
+        if compact:
+            df = compact_frame(df)
+            self.track_frame(table_name, df)
+        return df
+
+    def update_data_cache(self, table_name, geographies=None):
+        # Convert a missing or stale table, or one ingested with a prefix that
+        # does not cover geographies, one thread at a time
+        if is_data_readable(table_name, read_manifest(), geographies):
+            return
+        with self.lock:
+            manifest = read_manifest()
+            if not is_data_readable(table_name, manifest, geographies):
+                write_manifest({table_name: cache_data(table_name, self.chunksize)})
+
+    def dataset_index(self, table_name):
+        # Hashed index from the tuple of category values to the Dataset code
+        dataset_indexes = self.dataset_indexes
+        if table_name not in dataset_indexes:
+            tdf = self.read_table(table_name)
+            keys = zip(*[tdf[col] for col in get_table_columns(tdf)])
+            dataset_indexes[table_name] = dict(zip(keys, tdf['Dataset']))
+        return dataset_indexes[table_name]
+
+    def resolve_dataset(self, table_name, categories):
+        # Dataset code for category values, given in table column order
+        return self.dataset_index(table_name)[tuple(categories)]
+
+    def track_frame(self, name, df):
+        # Remember a frame for memory_report, until it is garbage collected
+        frame_id = next(self.frame_ids)
+        ref = weakref.ref(df, lambda ref: self.tracked_frames.pop(frame_id, None))
+        with self.lock:
+            self.tracked_frames[frame_id] = (name, ref)
+
+    def memory_report(self):
+        # Bytes held by each live tracked frame
+        with self.lock:
+            frames = [(name, ref()) for name, ref in list(self.tracked_frames.values())]
+        rows = [(name, len(df), len(df.columns),
+                 df.memory_usage(index=True, deep=True).sum())
+                for name, df in frames if df is not None]
+        report = pd.DataFrame(
+            rows, columns=['Frame', 'Rows', 'Columns', 'Bytes'])
+        return report.sort_values('Bytes', ascending=False, ignore_index=True)
+
+
+# Default reader, used by the module functions
+reader = CensusReader()
+
+
+def read_index():
+    return reader.read_index()
+
+
+def read_table(table_name):
+    return reader.read_table(table_name)
+
+
+def read_data(table_name, columns=None, geographies=None, cache=True, compact=False):
+    return reader.read_data(table_name, columns, geographies, cache, compact)
+
+
+def dataset_index(table_name):
+    return reader.dataset_index(table_name)
+
+
+def resolve_dataset(table_name, categories):
+    return reader.resolve_dataset(table_name, categories)
+
+
+def track_frame(name, df):
+    reader.track_frame(name, df)
+
+
+def memory_report():
+    return reader.memory_report()
+
+
 if __name__ == '__main__':
     index = read_index()
     print(index.head())
@@ -164,5 +582,14 @@ if __name__ == '__main__':
     print(get_table_column_names_and_values(tdf))
     print(tdf.head())
     data_name = tdf['Dataset'][0]
+    print(resolve_dataset(table_name, tdf.iloc[0, :-1]))
     df = read_data(table_name)
     print(df.head())
+    geography = read_geography()
+    lookup = Geography(geography)
+    print(lookup.names_for(lookup.lad_codes[:5]))
+    df = read_data(table_name, compact=True)
+    mdf = compact_frame(pd.merge(df, geography, on=LOCATION_COL))
+    track_frame('merged ' + table_name, mdf)
+    print(memory_report())
+    ingest_data([table[0] for table in get_table_names(index)])
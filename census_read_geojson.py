@@ -1,72 +1,266 @@
 import geopandas as gpd
+import hashlib
 import json
+import numpy as np
 import os
+import shapely
+from shapely.geometry import mapping, shape
+from census_read_geopandas import LAYER_KEYS, LEVEL_TOLERANCES, LONDON, RegionBounds, \
+    level_for_extent, read_bounds, read_region, region_key, simplify_coverage
 
+GEOJSON_PRECISION = 5   # Decimal places of longitude and latitude, about a metre
 
-def read_london_ward_geojson():
+
+class JsonStream:
+    # Decodes JSON values one at a time from a text file, holding only one
+    # block of the file and the value being decoded in memory
+
+    def __init__(self, f, blocksize=1 << 20):
+        self.f = f
+        self.blocksize = blocksize
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        block = self.f.read(self.blocksize)
+        self.eof = block == ''
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+
+    def peek(self):
+        # Next character that is not whitespace
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ValueError('Unexpected end of JSON')
+            self.fill()
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise ValueError(f'Expected one of {chars!r} in JSON, found {c!r}')
+        self.pos += 1
+        return c
+
+    def value(self):
+        # Decode the next value, reading more of the file until it is complete.
+        # A value ending at the end of the buffer may continue, e.g. a number
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def elements(self, close):
+        # Step through the members of an object or items of an array, whose
+        # opening bracket has been read, stopping at the close bracket
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(',' + close) == close:
+                return
+
+
+def filter_geojson(in_jsonfile, out_jsonfile, keep):
+    # Write the features of a GeoJSON FeatureCollection for which keep(feature)
+    # is true, decoding and writing one feature at a time, so memory is bounded
+    # by the largest feature rather than the input file
+    tmpfile = out_jsonfile + '.tmp'
+    with open(in_jsonfile) as fin, open(tmpfile, 'w') as fout:
+        stream = JsonStream(fin)
+        stream.expect('{')
+        fout.write('{')
+        for i, _ in enumerate(stream.elements('}')):
+            key = stream.value()
+            stream.expect(':')
+            fout.write((', ' if i else '') + json.dumps(key) + ': ')
+            if key == 'features':
+                stream.expect('[')
+                fout.write('[')
+                kept = 0
+                for _ in stream.elements(']'):
+                    feature = stream.value()
+                    if keep(feature):
+                        fout.write(',\n' if kept else '\n')
+                        json.dump(feature, fout)
+                        kept += 1
+                fout.write('\n]')
+            else:
+                json.dump(stream.value(), fout)
+        fout.write('}\n')
+    os.replace(tmpfile, out_jsonfile)
+
+
+def simplify_geojson(gj, level):
+    # Copy of GeoJSON with its features simplified together to level
+    geometries = [shape(f['geometry']) for f in gj['features']]
+    simplified = simplify_coverage(geometries, level)
+    features = [dict(f, geometry=mapping(g))
+                for f, g in zip(gj['features'], simplified)]
+    return dict(gj, features=features)
+
+
+def quantize_geojson(gj, precision=GEOJSON_PRECISION, keep=None):
+    # Copy of GeoJSON for the browser, with coordinates snapped to precision
+    # decimal places (shared borders snap alike), repeated points dropped and
+    # only the keep properties, e.g. the featureidkey
+    geometries = shapely.set_precision(
+        np.array([shape(f['geometry']) for f in gj['features']]), 10**-precision)
+    features = [{'type': 'Feature',
+                 'properties': f['properties'] if keep is None else
+                 {k: f['properties'][k] for k in keep},
+                 'geometry': mapping(g)}
+                for f, g in zip(gj['features'], geometries)]
+    return {'type': gj['type'], 'features': features}
+
+
+def write_topojson(gj, topojsonfile, quantization=1e5):
+    # Write GeoJSON as TopoJSON, shared borders stored once as arcs and
+    # coordinates quantized to a quantization by quantization grid
+    import topojson   # Only needed for TopoJSON output
+    gdf = gpd.GeoDataFrame.from_features(gj['features'], crs=4326)
+    topology = topojson.Topology(gdf, prequantize=quantization, toposimplify=False)
+    tmpfile = topojsonfile + '.tmp'
+    with open(tmpfile, 'w') as f:
+        f.write(topology.to_json())
+    os.replace(tmpfile, topojsonfile)
+
+
+def read_london_topojson(layer, level=0, quantization=1e5):
+
+    # Get London 'ward' or 'lad' TopoJSON, written from the cached GeoJSON
+    read_geojson = read_london_ward_geojson if layer == 'ward' else read_london_lad_geojson
+    name = 'Ward' if layer == 'ward' else 'LAD'
+    topojsonfile = f"data/json_files/London_{name}_Boundaries_{level}_{int(quantization)}.topojson"
+    if not os.path.exists(topojsonfile):
+        write_topojson(read_geojson(level), topojsonfile, quantization)
+    with open(topojsonfile) as f:
+        return json.load(f)
+
+
+def write_geojson_bounds(gj, jsonfile, key):
+    # Bounding boxes of GeoJSON features, LADs and extent, saved next to the file
+    gdf = gpd.GeoDataFrame.from_features(gj['features'])
+    region_bounds = RegionBounds.from_gdf(gdf, key)
+    region_bounds.save(jsonfile.replace('.json', '-bounds.npz'))
+    return region_bounds
+
+
+def read_london_bounds(layer):
+
+    # Bounding boxes of the London 'ward' or 'lad' GeoJSON features, written
+    # when the GeoJSON is built, so figures drawn from it need no shapefile
+    read_geojson = read_london_ward_geojson if layer == 'ward' else read_london_lad_geojson
+    name = 'Ward' if layer == 'ward' else 'LAD'
+    london_jsonfile = f"data/json_files/London_{name}_Boundaries.json"
+    boundsfile = london_jsonfile.replace('.json', '-bounds.npz')
+    if not os.path.exists(boundsfile):
+        return write_geojson_bounds(read_geojson(), london_jsonfile, LAYER_KEYS[layer])
+    return RegionBounds.load(boundsfile)
+
+
+def read_level_geojson(read_geojson, jsonfile, level):
+    # Get simplified GeoJSON, building it from the full resolution GeoJSON
+    level_jsonfile = jsonfile.replace('.json', f'_{level}.json')
+    if not os.path.exists(level_jsonfile):
+        level_gj = simplify_geojson(read_geojson(), level)
+        tmpfile = f'{level_jsonfile}.tmp{os.getpid()}'
+        with open(tmpfile, 'w') as f:
+            json.dump(level_gj, f)
+        os.replace(tmpfile, level_jsonfile)
+    else:
+        with open(level_jsonfile) as f:
+            level_gj = json.load(f)
+    return level_gj
+
+
+def write_geojson(gdf, jsonfile):
+    tmpfile = f'{jsonfile}.tmp{os.getpid()}'
+    gdf.to_file(tmpfile, driver='GeoJSON')
+    os.replace(tmpfile, jsonfile)
+
+
+def read_region_geojson(layer, region=LONDON, level=0):
+
+    # Get GeoJSON for the 'ward' or 'lad' features of any region, see read_region
+    key = f'{layer}|{region_key(region)}|{level}'
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    region_jsonfile = f"data/json_files/Region_{layer}_{digest}.json"
+    if not os.path.exists(region_jsonfile):
+        write_geojson(read_region(layer, region, level=level), region_jsonfile)
+    with open(region_jsonfile) as f:
+        return json.load(f)
+
+
+def read_london_ward_geojson(level=0):
 
     # Get London GeoJSON
     london_jsonfile = "data/json_files/London_Ward_Boundaries.json"
-    if not os.path.exists(london_jsonfile):
+    if level > 0:
+        return read_level_geojson(read_london_ward_geojson, london_jsonfile, level)
+    built = not os.path.exists(london_jsonfile)
+    if built:
 
         # Census Ward Boundaries as GeoJSON
         census_jsonfile = "data/json_files/Census_Merged_Wards_(December_2011)_Boundaries.json"
-        if not os.path.exists(census_jsonfile):
-
-            # Get Census Boundaries as GeoPandas
-            shapefile = 'data/Census_Merged_Wards_(December_2011)_Boundaries/Census_Merged_Wards_(December_2011)_Boundaries.shp'
-            gdf = gpd.read_file(shapefile)
-            # Convert coordinates
-            gdf.to_crs(epsg=4326, inplace=True)
-            # Write GeoJSON
-            gdf.to_file(
-                "data/json_files/Census_Merged_Wards_(December_2011)_Boundaries.json", driver='GeoJSON')
-
-        with open(census_jsonfile) as f:
-            census_wards = json.load(f)
-
-        london_wards = census_wards
-        london_wards['features'] = list(filter(
-            lambda f: f['properties']['lad11cd'].startswith('E090000'), london_wards['features']))
-        with open(london_jsonfile, 'w') as f:
-            json.dump(london_wards, f)
-    else:
-        with open(london_jsonfile) as f:
-            london_wards = json.load(f)
+        if os.path.exists(census_jsonfile):
+            # Stream the national features, keeping only London's
+            filter_geojson(census_jsonfile, london_jsonfile,
+                           lambda f: f['properties']['lad11cd'].startswith(LONDON))
+        else:
+            # London's features from the GeoParquet cache, see read_region,
+            # without loading the national layer
+            write_geojson(read_region('ward', LONDON), london_jsonfile)
+
+    with open(london_jsonfile) as f:
+        london_wards = json.load(f)
+    if built:
+        write_geojson_bounds(london_wards, london_jsonfile, 'cmwd11cd')
     return london_wards
 
 
-def read_london_lad_geojson():
+def read_london_lad_geojson(level=0):
 
     # Get LAD GeoJSON
     london_jsonfile = "data/json_files/London_LAD_Boundaries.json"
-    if not os.path.exists(london_jsonfile):
+    if level > 0:
+        return read_level_geojson(read_london_lad_geojson, london_jsonfile, level)
+    built = not os.path.exists(london_jsonfile)
+    if built:
 
         lad_jsonfile = "data/json_files/Local_Authority_Districts_(December_2011)_Boundaries_EW_BFC.json"
-        if not os.path.exists(lad_jsonfile):
-
-            # Get Census LAD Boundaries as GeoPandas
-            shapefile = 'data/Local_Authority_Districts_(December_2011)_Boundaries_EW_BFC/Local_Authority_Districts_(December_2011)_Boundaries_EW_BFC.shp'
-            ladgdf = gpd.read_file(shapefile)
-            # Convert coordinates
-            ladgdf.to_crs(epsg=4326, inplace=True)
-            # Write GeoJSON
-            ladgdf.to_file(lad_jsonfile, driver='GeoJSON')
-
-        with open(lad_jsonfile) as f:
-            census_lads = json.load(f)
-
-        london_lads = census_lads
-        london_lads['features'] = list(filter(
-            lambda f: f['properties']['lad11cd'].startswith('E090000'), london_lads['features']))
-        with open(london_jsonfile, 'w') as f:
-            json.dump(london_lads, f)
-    else:
-        with open(london_jsonfile) as f:
-            london_lads = json.load(f)
+        if os.path.exists(lad_jsonfile):
+            # Stream the national features, keeping only London's
+            filter_geojson(lad_jsonfile, london_jsonfile,
+                           lambda f: f['properties']['lad11cd'].startswith(LONDON))
+        else:
+            # London's features from the GeoParquet cache, see read_region,
+            # without loading the national layer
+            write_geojson(read_region('lad', LONDON), london_jsonfile)
+
+    with open(london_jsonfile) as f:
+        london_lads = json.load(f)
+    if built:
+        write_geojson_bounds(london_lads, london_jsonfile, 'lad11cd')
     return london_lads
 
 
 if __name__ == '__main__':
     london_wards = read_london_ward_geojson()
     london_lads = read_london_lad_geojson()
+    for level in range(1, len(LEVEL_TOLERANCES)):
+        read_london_ward_geojson(level)
+        read_london_lad_geojson(level)
@@ -1,30 +1,236 @@
 import geopandas as gpd
+import hashlib
+import numpy as np
+import os
+import shapely
 
+WARD_SHAPEFILE = 'data/Census_Merged_Wards_(December_2011)_Boundaries/Census_Merged_Wards_(December_2011)_Boundaries.shp'
+LAD_SHAPEFILE = 'data/Local_Authority_Districts_(December_2011)_Boundaries_EW_BFC/Local_Authority_Districts_(December_2011)_Boundaries_EW_BFC.shp'
+GEOMETRY_CACHE = 'data/cache/geometry'
+LONDON = 'E090000'
+LAYERS = {'ward': WARD_SHAPEFILE, 'lad': LAD_SHAPEFILE}
+LAYER_KEYS = {'ward': 'cmwd11cd', 'lad': 'lad11cd'}
+# Simplification tolerance in degrees for each level, level 0 is full resolution
+LEVEL_TOLERANCES = [0, 0.0001, 0.0005, 0.002]
+shapefile_hashes = {}
+layer_indexes = {}
 
-def read_london_ward_geopandas():
 
-    # Get Census Boundaries as GeoPandas
-    shapefile = 'data/Census_Merged_Wards_(December_2011)_Boundaries/Census_Merged_Wards_(December_2011)_Boundaries.shp'
-    gdf = gpd.read_file(shapefile)
-    # Convert coordinates
-    gdf.to_crs(epsg=4326, inplace=True)
+def shapefile_hash(shapefile):
+    # Hash of the shapefile and its sidecar files, remembered until the .shp changes
+    stat = os.stat(shapefile)
+    memo = (shapefile, stat.st_size, stat.st_mtime_ns)
+    if memo in shapefile_hashes:
+        return shapefile_hashes[memo]
+    sha = hashlib.sha256()
+    base = os.path.splitext(shapefile)[0]
+    for ext in ['.shp', '.shx', '.dbf', '.prj']:
+        if os.path.exists(base+ext):
+            with open(base+ext, 'rb') as sf:
+                for block in iter(lambda: sf.read(1 << 20), b''):
+                    sha.update(block)
+    shapefile_hashes[memo] = sha.hexdigest()
+    return shapefile_hashes[memo]
 
-    # London
-    lgdf = gdf[gdf['lad11cd'].str.startswith('E090000')]
-    return lgdf
 
+def geometry_cache_file(shapefile, prefix, epsg, level=0):
+    # Cache file name is keyed by shapefile hash, region filter, target CRS
+    # and simplification tolerance
+    key = f'{shapefile_hash(shapefile)}|{prefix}|{epsg}'
+    if level > 0:
+        key += f'|{LEVEL_TOLERANCES[level]}'
+    name = os.path.splitext(os.path.basename(shapefile))[0]
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return f'{GEOMETRY_CACHE}/{name}-{digest}.parquet'
 
-def read_london_lad_geopandas():
 
-    # Get Local Authority Boundaries as GeoPandas
-    shapefile = 'data/Local_Authority_Districts_(December_2011)_Boundaries_EW_BFC/Local_Authority_Districts_(December_2011)_Boundaries_EW_BFC.shp'
-    gdf = gpd.read_file(shapefile)
-    # Convert coordinates
-    gdf.to_crs(epsg=4326, inplace=True)
+def simplify_coverage(geometries, level):
+    # Simplify polygons together as a coverage, so neighbours still share edges
+    if level == 0:
+        return geometries
+    return shapely.coverage_simplify(np.asarray(geometries), LEVEL_TOLERANCES[level])
 
-    # London
-    ladgdf = gdf[gdf['lad11cd'].str.startswith('E090000')]
-    return ladgdf
+
+def level_for_extent(bbox, pixels=1200):
+    # Most simplified level whose tolerance is within a pixel of the view
+    degrees_per_pixel = max(bbox[2]-bbox[0], bbox[3]-bbox[1]) / pixels
+    return max(level for level, tolerance in enumerate(LEVEL_TOLERANCES)
+               if tolerance <= degrees_per_pixel)
+
+
+def region_key(region):
+    # Text for a region, used in its cache file key.
+    # A str is a LAD11CD prefix, four numbers a bounding box, otherwise LAD11CDs
+    if isinstance(region, str):
+        return region
+    if is_bbox(region):
+        return 'bbox' + ','.join(repr(float(v)) for v in region)
+    return 'lads' + ','.join(sorted(region))
+
+
+def is_bbox(region):
+    return len(region) == 4 and not any(isinstance(v, str) for v in region)
+
+
+class LayerIndex:
+    # National layer with a spatial index over its geometries and a sorted
+    # LAD11CD index, so any region is found without scanning every feature
+
+    def __init__(self, gdf):
+        self.gdf = gdf
+        self.tree = shapely.STRtree(gdf.geometry.values)
+        codes = gdf['lad11cd'].to_numpy(dtype=str)
+        self.order = np.argsort(codes, kind='stable')
+        self.codes = codes[self.order]
+
+    def with_prefix(self, prefix):
+        # Positions of features whose lad11cd starts with prefix
+        start = np.searchsorted(self.codes, prefix, side='left')
+        stop = np.searchsorted(self.codes, prefix + '\uffff', side='left')
+        return self.order[start:stop]
+
+    def select(self, region):
+        # Positions of the features of a region, in file order
+        if isinstance(region, str):
+            positions = self.with_prefix(region)
+        elif is_bbox(region):
+            positions = self.tree.query(shapely.box(*region), predicate='intersects')
+        else:
+            positions = np.concatenate(
+                [self.with_prefix(code) for code in region] + [np.empty(0, dtype=int)])
+        return np.sort(positions)
+
+
+def read_national(layer, epsg=4326):
+    # Every feature of a layer, converted to epsg, from the GeoParquet cache
+    shapefile = LAYERS[layer]
+    cachefile = geometry_cache_file(shapefile, '', epsg)
+    if os.path.exists(cachefile):
+        return gpd.read_parquet(cachefile)
+    gdf = gpd.read_file(shapefile).to_crs(epsg=epsg)
+    write_geometry_cache(gdf, cachefile)
+    return gdf
+
+
+def layer_index(layer, epsg=4326):
+    # Index over the national layer, built once per process
+    if (layer, epsg) not in layer_indexes:
+        layer_indexes[(layer, epsg)] = LayerIndex(read_national(layer, epsg))
+    return layer_indexes[(layer, epsg)]
+
+
+def write_geometry_cache(gdf, cachefile):
+    os.makedirs(GEOMETRY_CACHE, exist_ok=True)
+    tmpfile = f'{cachefile}.tmp{os.getpid()}'
+    gdf.to_parquet(tmpfile)
+    os.replace(tmpfile, cachefile)
+
+
+def read_region(layer, region=LONDON, epsg=4326, level=0):
+    # Read the 'ward' or 'lad' features of a region, converted to epsg and
+    # simplified to level. region is a LAD11CD prefix such as 'E09', a list of
+    # LAD11CDs, or a bounding box (minx, miny, maxx, maxy) in epsg coordinates.
+    # Each region is cached as GeoParquet, and built from the indexed national layer
+    shapefile = LAYERS[layer]
+    cachefile = geometry_cache_file(shapefile, region_key(region), epsg, level)
+    if os.path.exists(cachefile):
+        return gpd.read_parquet(cachefile)
+
+    if level > 0:
+        gdf = read_region(layer, region, epsg)
+        gdf = gdf.set_geometry(simplify_coverage(gdf.geometry.values, level),
+                               crs=gdf.crs)
+    elif isinstance(region, str) and region and \
+            not os.path.exists(geometry_cache_file(shapefile, '', epsg)):
+        # Read only the region's features from the shapefile, rather than
+        # loading the national layer for one region
+        gdf = gpd.read_file(shapefile, where=f"lad11cd LIKE '{region}%'").to_crs(epsg=epsg)
+    else:
+        index = layer_index(layer, epsg)
+        gdf = index.gdf.iloc[index.select(region)]
+
+    write_geometry_cache(gdf, cachefile)
+    return gdf
+
+
+class RegionBounds:
+    # Bounding boxes (minx, miny, maxx, maxy) of each feature of a region,
+    # with their union for each LAD and for the whole region
+
+    def __init__(self, codes, bounds, lad_codes, lad_bounds, bbox):
+        self.codes = codes
+        self.bounds = bounds
+        self.lad_codes = lad_codes      # Sorted
+        self.lad_bounds = lad_bounds
+        self.bbox = bbox
+        self.positions = dict(zip(codes.tolist(), range(len(codes))))
+
+    @classmethod
+    def from_gdf(cls, gdf, key):
+        bounds = shapely.bounds(gdf.geometry.values)
+        lad_codes, lad_rows = np.unique(gdf['lad11cd'].to_numpy(dtype=str),
+                                        return_inverse=True)
+        lad_bounds = np.full((len(lad_codes), 4), np.nan)
+        np.fmin.at(lad_bounds[:, :2], lad_rows, bounds[:, :2])
+        np.fmax.at(lad_bounds[:, 2:], lad_rows, bounds[:, 2:])
+        bbox = union_bbox(bounds)
+        return cls(gdf[key].to_numpy(dtype=str), bounds, lad_codes, lad_bounds, bbox)
+
+    @classmethod
+    def load(cls, boundsfile):
+        with np.load(boundsfile) as npz:
+            return cls(npz['codes'], npz['bounds'], npz['lad_codes'],
+                       npz['lad_bounds'], npz['bbox'])
+
+    def save(self, boundsfile):
+        tmpfile = boundsfile.replace('.npz', f'.tmp{os.getpid()}.npz')
+        np.savez(tmpfile, codes=self.codes, bounds=self.bounds,
+                 lad_codes=self.lad_codes, lad_bounds=self.lad_bounds, bbox=self.bbox)
+        os.replace(tmpfile, boundsfile)
+
+    def feature_bbox(self, codes):
+        # Union of the bounding boxes of features
+        return union_bbox(self.bounds[[self.positions[code] for code in codes]])
+
+    def lad_bbox(self, lad_code):
+        # Union of the bounding boxes of one LAD's features
+        row = np.searchsorted(self.lad_codes, lad_code)
+        if row == len(self.lad_codes) or self.lad_codes[row] != lad_code:
+            raise KeyError(lad_code)
+        return self.lad_bounds[row]
+
+
+def union_bbox(bounds):
+    return np.concatenate([np.nanmin(bounds[:, :2], axis=0),
+                           np.nanmax(bounds[:, 2:], axis=0)])
+
+
+def read_bounds(layer, region=LONDON, epsg=4326):
+    # Bounding boxes of a region's features, LADs and extent, computed once
+    # from read_region and cached next to it
+    shapefile = LAYERS[layer]
+    cachefile = geometry_cache_file(
+        shapefile, region_key(region), epsg).replace('.parquet', '-bounds.npz')
+    if os.path.exists(cachefile):
+        return RegionBounds.load(cachefile)
+
+    region_bounds = RegionBounds.from_gdf(read_region(layer, region, epsg),
+                                          LAYER_KEYS[layer])
+    os.makedirs(GEOMETRY_CACHE, exist_ok=True)
+    region_bounds.save(cachefile)
+    return region_bounds
+
+
+def read_london_ward_geopandas(level=0):
+
+    # Get Census Boundaries as GeoPandas, for London
+    return read_region('ward', LONDON, level=level)
+
+
+def read_london_lad_geopandas(level=0):
+
+    # Get Local Authority Boundaries as GeoPandas, for London
+    return read_region('lad', LONDON, level=level)
 
 
 if __name__ == '__main__':
@@ -32,3 +238,6 @@ if __name__ == '__main__':
     print(london_wards_gdf.head())
     london_lads_gdf = read_london_lad_geopandas()
     print(london_lads_gdf.head())
+    for level in range(1, len(LEVEL_TOLERANCES)):
+        print(level, read_london_ward_geopandas(level).geometry.count_coordinates().sum(),
+              read_london_lad_geopandas(level).geometry.count_coordinates().sum())
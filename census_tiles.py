@@ -0,0 +1,193 @@
+import gzip
+import json
+import os
+import sqlite3
+from contextlib import closing
+import numpy as np
+import shapely
+from flask import Response, abort, request, send_file
+import census_read_data as crd
+import census_read_geopandas as crgp
+
+TILES_FILE = 'data/cache/tiles/census.mbtiles'
+MIN_ZOOM = 5
+MAX_ZOOM = 12       # Clients overzoom beyond this
+EXTENT = 4096       # Tile coordinates across one tile
+BUFFER = 64         # Tile coordinates kept outside each tile, hides seams at edges
+WORLD = 20037508.342789244  # Half the width of the Web Mercator world in metres
+MAP_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'census_tiles_map.html')
+# Tile layer: feature code and name columns
+TILE_LAYERS = {'ward': ('cmwd11cd', 'cmwd11nm'), 'lad': ('lad11cd', 'lad11nm')}
+
+
+def tile_bounds(zoom, x, y):
+    # Web Mercator bounds of an XYZ tile
+    size = 2 * WORLD / 2**zoom
+    minx = -WORLD + x * size
+    maxy = WORLD - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+
+def tiles_for_bounds(bounds, zoom):
+    # XYZ tiles covering Web Mercator bounds
+    size = 2 * WORLD / 2**zoom
+    last = 2**zoom - 1
+    x0, x1 = (np.clip(np.floor((np.array([bounds[0], bounds[2]]) + WORLD) / size), 0, last)
+              .astype(int))
+    y0, y1 = (np.clip(np.floor((WORLD - np.array([bounds[3], bounds[1]])) / size), 0, last)
+              .astype(int))
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def layer_properties(gdf, layer):
+    # Tile feature properties, data is joined on GeographyCode by the client
+    code, name = TILE_LAYERS[layer]
+    return [{'GeographyCode': c, 'Name': n, 'LAD11CD': lad}
+            for c, n, lad in zip(gdf[code], gdf[name], gdf['lad11cd'])]
+
+
+def build_tiles(region='', min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, tilesfile=TILES_FILE):
+    # Write the ward and LAD boundaries of a region (default all of England and
+    # Wales, see read_region) as a Mapbox Vector Tile pyramid in an MBTiles file.
+    # Each zoom is simplified as a coverage to one tile pixel, so borders still meet
+    import mapbox_vector_tile   # Only needed to build tiles, not to serve them
+    layers = {layer: crgp.read_region(layer, region, epsg=3857) for layer in TILE_LAYERS}
+    properties = {layer: layer_properties(gdf, layer) for layer, gdf in layers.items()}
+    bounds = crgp.union_bbox(np.array([gdf.total_bounds for gdf in layers.values()]))
+
+    os.makedirs(os.path.dirname(tilesfile), exist_ok=True)
+    tmpfile = tilesfile + '.tmp'
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+    with closing(sqlite3.connect(tmpfile)) as db:
+        db.execute('CREATE TABLE metadata (name text, value text)')
+        db.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, '
+                   'tile_row integer, tile_data blob)')
+        for zoom in range(min_zoom, max_zoom + 1):
+            pixel = 2 * WORLD / 2**zoom / EXTENT
+            zoom_layers = {}
+            for layer, gdf in layers.items():
+                geometries = shapely.coverage_simplify(np.asarray(gdf.geometry.values), pixel)
+                zoom_layers[layer] = (shapely.STRtree(geometries), geometries)
+            for x, y in tiles_for_bounds(bounds, zoom):
+                tb = tile_bounds(zoom, x, y)
+                margin = BUFFER * pixel
+                clip = (tb[0] - margin, tb[1] - margin, tb[2] + margin, tb[3] + margin)
+                tile_layers = []
+                for layer, (tree, geometries) in zoom_layers.items():
+                    rows = tree.query(shapely.box(*clip), predicate='intersects')
+                    clipped = shapely.clip_by_rect(geometries[rows], *clip)
+                    features = [{'geometry': g, 'properties': properties[layer][row]}
+                                for row, g in zip(rows, clipped) if not g.is_empty]
+                    if features:
+                        tile_layers.append({'name': layer, 'features': features})
+                if tile_layers:
+                    data = mapbox_vector_tile.encode(tile_layers, default_options={
+                        'quantize_bounds': tb, 'extents': EXTENT,
+                        'on_invalid_geometry': mapbox_vector_tile.encoder.on_invalid_geometry_make_valid})
+                    # MBTiles rows count from the south
+                    db.execute('INSERT INTO tiles VALUES (?, ?, ?, ?)',
+                               (zoom, x, 2**zoom - 1 - y, gzip.compress(data)))
+        db.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+
+        west, south = mercator_to_lonlat(bounds[0], bounds[1])
+        east, north = mercator_to_lonlat(bounds[2], bounds[3])
+        vector_layers = [{'id': layer, 'fields': {'GeographyCode': 'String', 'Name': 'String',
+                                                  'LAD11CD': 'String'}}
+                         for layer in TILE_LAYERS]
+        metadata = {
+            'name': 'census', 'format': 'pbf', 'type': 'overlay',
+            'minzoom': str(min_zoom), 'maxzoom': str(max_zoom),
+            'bounds': f'{west},{south},{east},{north}',
+            'center': f'{(west + east) / 2},{(south + north) / 2},{min_zoom}',
+            'json': json.dumps({'vector_layers': vector_layers})
+        }
+        db.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
+        db.commit()
+    os.replace(tmpfile, tilesfile)
+    return tilesfile
+
+
+def mercator_to_lonlat(x, y):
+    lon = np.degrees(x / WORLD * np.pi)
+    lat = np.degrees(2 * np.arctan(np.exp(y / WORLD * np.pi)) - np.pi / 2)
+    return float(lon), float(lat)
+
+
+def read_tile(zoom, x, y, tilesfile=TILES_FILE):
+    # Gzipped tile data for an XYZ tile, None if the tile is empty
+    with closing(sqlite3.connect(f'file:{tilesfile}?mode=ro', uri=True)) as db:
+        row = db.execute('SELECT tile_data FROM tiles WHERE zoom_level = ? AND '
+                         'tile_column = ? AND tile_row = ?',
+                         (zoom, x, 2**zoom - 1 - y)).fetchone()
+    return None if row is None else row[0]
+
+
+def read_tile_metadata(tilesfile=TILES_FILE):
+    with closing(sqlite3.connect(f'file:{tilesfile}?mode=ro', uri=True)) as db:
+        return dict(db.execute('SELECT name, value FROM metadata').fetchall())
+
+
+def add_tile_routes(server, tilesfile=TILES_FILE, prefix='/tiles'):
+    # Serve the tiles from a Flask server, e.g. a Dash app's app.server, at
+    # prefix/{z}/{x}/{y}.pbf, described by TileJSON at prefix/tiles.json, and
+    # a MapLibre page drawing them at prefix/map?table=...&column=...&layer=ward
+
+    def tile(zoom, x, y):
+        if not os.path.exists(tilesfile):
+            abort(404)
+        data = read_tile(zoom, x, y, tilesfile)
+        if data is None:
+            return Response(status=204)
+        return Response(data, mimetype='application/vnd.mapbox-vector-tile',
+                        headers={'Content-Encoding': 'gzip',
+                                 'Cache-Control': 'public, max-age=86400'})
+
+    def tilejson():
+        if not os.path.exists(tilesfile):
+            abort(404)
+        metadata = read_tile_metadata(tilesfile)
+        return {
+            'tilejson': '3.0.0',
+            'tiles': [request.host_url.rstrip('/') + prefix + '/{z}/{x}/{y}.pbf'],
+            'minzoom': int(metadata['minzoom']),
+            'maxzoom': int(metadata['maxzoom']),
+            'bounds': [float(v) for v in metadata['bounds'].split(',')],
+            'vector_layers': json.loads(metadata['json'])['vector_layers']
+        }
+
+    def map_page():
+        return send_file(MAP_PAGE)
+
+    server.add_url_rule(prefix + '/<int:zoom>/<int:x>/<int:y>.pbf',
+                        'census_tile', tile)
+    server.add_url_rule(prefix + '/tiles.json', 'census_tilejson', tilejson)
+    server.add_url_rule(prefix + '/map', 'census_tile_map', map_page)
+
+
+def add_value_routes(server, prefix='/values'):
+    # Serve the values of one data column at prefix/{table}/{column}, as
+    # {GeographyCode: value}, for clients to join to the tile features
+
+    def values(table_name, column):
+        try:
+            datasets = set(crd.dataset_index(table_name).values())
+        except KeyError:
+            abort(404)
+        if not column.startswith(table_name) or column[len(table_name):] not in datasets:
+            abort(404)
+        df = crd.read_data(table_name, columns=[column])
+        response = dict(zip(df[crd.LOCATION_COL], df[column].tolist()))
+        return response, {'Cache-Control': 'public, max-age=86400'}
+
+    server.add_url_rule(prefix + '/<table_name>/<column>', 'census_values', values)
+
+
+if __name__ == '__main__':
+    from flask import Flask
+    if not os.path.exists(TILES_FILE):
+        build_tiles()
+    server = Flask(__name__)
+    add_tile_routes(server)
+    add_value_routes(server)
+    server.run(port=8050)